@@ -0,0 +1,91 @@
+# In Notifications/connections.py
+import threading
+from collections import OrderedDict, defaultdict
+
+import requests
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Endpoints come from clients, so origins are not a fixed set; past this many
+# the least recently used session is closed
+MAX_SESSIONS = 128
+
+_lock = threading.Lock()
+_sessions = OrderedDict()  # push-service origin -> requests.Session, least recently used first
+_sent = defaultdict(int)  # push-service origin -> requests sent through the pool
+
+
+def session_for(origin):
+    """
+    A keep-alive session for one push-service origin, shared for the life of
+    the worker process so TCP and TLS handshakes are paid once, not per push.
+    """
+    evicted = None
+    with _lock:
+        session = _sessions.get(origin)
+        if session is not None:
+            _sessions.move_to_end(origin)
+            return session
+
+        session = requests.Session()
+        # One host per session; size the pool to match the in-flight cap
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.PUSH_MAX_IN_FLIGHT_PER_HOST,
+            max_retries=0,
+        )
+        session.mount(origin, adapter)
+        _sessions[origin] = session
+        if len(_sessions) > MAX_SESSIONS:
+            evicted_origin, evicted = _sessions.popitem(last=False)
+            _sent.pop(evicted_origin, None)
+    if evicted is not None:
+        # Connections still in use are closed as they are returned
+        evicted.close()
+    return session
+
+
+def record_request(origin):
+    # Counted for origins with a live session only, see session_for
+    with _lock:
+        if origin in _sessions:
+            _sent[origin] += 1
+
+
+def pool_stats():
+    """
+    Per-origin pool metrics: requests sent, connections opened and the reuse
+    ratio. A healthy pool has far fewer connections than requests.
+    """
+    stats = {}
+    with _lock:
+        sessions = dict(_sessions)
+        sent = dict(_sent)
+
+    for origin, session in sessions.items():
+        pools = session.get_adapter(origin).poolmanager.pools
+        opened = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+        requests_sent = sent.get(origin, 0)
+        stats[origin] = {
+            "requests": requests_sent,
+            "connections_opened": opened,
+            "reuse_ratio": round(requests_sent / opened, 2) if opened else 0.0,
+        }
+    return stats
+
+
+def close_sessions():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+@worker_process_shutdown.connect
+def _close_sessions_on_shutdown(**kwargs):
+    close_sessions()
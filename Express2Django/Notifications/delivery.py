@@ -0,0 +1,215 @@
+# In Notifications/delivery.py
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+from django.conf import settings
+import requests
+from pywebpush import WebPusher, WebPushException
+
+from .connections import record_request, session_for
+from .encryption import pre_encrypt
+from .metrics import observe_send
+from .ratelimit import get_rate_limiter, parse_retry_after
+from .timing import StageTimer
+from .vapid import vapid_headers
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeliveryResult:
+    subscription_id: int
+    origin: str
+    status_code: int = None
+    error: str = None
+    transient: bool = False  # Worth retrying: throttled, 5xx, network or rate-limited locally
+    retry_after: float = None  # Seconds, from the push service's Retry-After
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def expired(self):
+        # The push service tells us the subscription is gone for good
+        return self.status_code in (404, 410)
+
+    @property
+    def retryable(self):
+        return not self.ok and self.transient
+
+
+def push_service_origin(endpoint):
+    url = urlparse(endpoint or '')
+    return f"{url.scheme}://{url.netloc}"
+
+
+class HostLimiter:
+    """Caps the number of in-flight requests per push-service origin."""
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def slot(self, origin):
+        with self._lock:
+            semaphore = self._semaphores.get(origin)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_in_flight)
+                self._semaphores[origin] = semaphore
+        return semaphore
+
+
+class TimedWebPusher(WebPusher):
+    """
+    WebPusher that charges payload encryption to its own stage, or skips it
+    when the body was already encrypted on the encryption pool.
+    """
+
+    def __init__(self, subscription_data, timer, body=None, **kwargs):
+        super().__init__(subscription_data, **kwargs)
+        self.timer = timer
+        self.body = body
+
+    def encode(self, *args, **kwargs):
+        if self.body is not None:
+            return {'body': self.body}
+        with self.timer.stage('encrypt'):
+            return super().encode(*args, **kwargs)
+
+
+def push(subscription_data, payload, timeout=None, timer=None, body=None):
+    """
+    Encrypt and send one payload, like pywebpush.webpush but with VAPID headers
+    from the per-origin signing cache and a pooled keep-alive connection.
+    `body` is the payload already encrypted for this subscription, if it was.
+    Stage timings go to `timer` if given. Raises WebPushException on failure.
+    """
+    timer = timer or StageTimer()
+    origin = push_service_origin(subscription_data.get('endpoint'))
+    session = session_for(origin)
+    record_request(origin)
+    with timer.stage('vapid_sign'):
+        headers = dict(vapid_headers(origin))
+    pusher = TimedWebPusher(subscription_data, timer, body, requests_session=session)
+    # Includes encryption; http_send minus encrypt is the network time
+    with timer.stage('http_send'):
+        response = pusher.send(
+            payload,
+            headers=headers,
+            content_encoding='aes128gcm',
+            timeout=timeout or settings.PUSH_TIMEOUT,
+        )
+    if response.status_code > 202:
+        raise WebPushException(
+            f"Push failed: {response.status_code} {response.reason}\nResponse body:{response.text}",
+            response=response,
+        )
+    return response
+
+
+def send_one(subscription, payload, limiter, timer, body=None):
+    subscription_data = subscription.subscription_json
+    origin = push_service_origin(subscription_data.get('endpoint'))
+    result = DeliveryResult(subscription_id=subscription.id, origin=origin)
+    own_timer = StageTimer()
+
+    with own_timer.stage('rate_wait'):
+        waited = wait_for_token(origin)
+    if waited is not None:
+        # Too long to hold a send thread for; hand it to the retry queue
+        result.error = f"Rate limited locally for {waited:.1f}s"
+        result.transient = True
+        result.retry_after = waited
+        timer.merge(own_timer)
+        observe_send(result, None)
+        return result
+
+    with limiter.slot(origin):
+        try:
+            response = push(subscription_data, payload, timer=own_timer, body=body)
+            result.status_code = response.status_code
+        except WebPushException as e:
+            # requests.Response is falsy for 4xx/5xx, so compare against None
+            if e.response is not None:
+                result.status_code = e.response.status_code
+                result.retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+            result.error = str(e)
+            result.transient = result.status_code == 429 or (result.status_code or 0) >= 500
+        except requests.RequestException as e:
+            # Timeouts and dropped connections
+            result.error = str(e)
+            result.transient = True
+        except Exception as e:
+            result.error = str(e)
+
+    if result.status_code == 429 or result.retry_after:
+        # Slow every worker down for this push service, not just this send
+        get_rate_limiter().pause(origin, result.retry_after or settings.PUSH_RETRY_BASE_DELAY)
+
+    timer.merge(own_timer)
+    observe_send(result, own_timer.seconds.get('http_send'))
+    if result.error:
+        logger.debug("Push failed", extra={
+            'subscription_id': result.subscription_id, 'origin': origin,
+            'status_code': result.status_code, 'error': result.error,
+        })
+    if random.random() < settings.PUSH_LOG_SAMPLE_RATE:
+        logger.info("Push sample", extra={
+            'subscription_id': result.subscription_id, 'origin': origin,
+            'status_code': result.status_code, 'ok': result.ok, 'stages_ms': own_timer.as_ms(),
+        })
+    return result
+
+
+def wait_for_token(origin):
+    """
+    Block until the origin's shared token bucket lets a push through. Returns
+    None once sending is allowed, or the remaining wait if it exceeds
+    PUSH_RATE_MAX_WAIT (e.g. the service asked for a long Retry-After pause).
+    """
+    limiter = get_rate_limiter()
+    while True:
+        wait = limiter.try_acquire(origin)
+        if not wait:
+            return None
+        if wait > settings.PUSH_RATE_MAX_WAIT:
+            return wait
+        time.sleep(wait)
+
+
+def deliver(subscriptions, payload, max_workers=None, max_in_flight_per_host=None, timer=None):
+    """
+    Send one payload to many subscriptions concurrently.
+
+    `subscriptions` may be a lazy iterator; it is consumed as sends complete so
+    only a bounded window of subscriptions is held in memory. Returns a
+    DeliveryResult per subscription, in completion order. Per-send stage
+    timings are added up in `timer` if given. Payloads are encrypted ahead on
+    the encryption pool when this process has one.
+    """
+    timer = timer or StageTimer()
+    max_workers = max_workers or settings.PUSH_MAX_WORKERS
+    if isinstance(payload, str):
+        # Encode once here rather than once per subscription inside WebPusher
+        payload = payload.encode('utf8')
+    limiter = HostLimiter(max_in_flight_per_host or settings.PUSH_MAX_IN_FLIGHT_PER_HOST)
+    results = []
+
+    # Threads are started lazily, so small audiences only get a few
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        for subscription, body in pre_encrypt(subscriptions, payload, timer):
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            pending.add(pool.submit(send_one, subscription, payload, limiter, timer, body))
+        results.extend(future.result() for future in pending)
+
+    return results
@@ -0,0 +1,147 @@
+# In Notifications/encryption.py
+#
+# Web Push encrypts the payload separately for every subscription (an ECDH
+# key agreement plus aes128gcm), which is CPU work that holds the GIL. For big
+# fan-outs the subscriptions are encrypted in batches on a process pool, one
+# process per core, and the ciphertext is handed to the send threads, which
+# then only do network I/O.
+#
+# Celery's prefork children are daemonic and may not start processes of their
+# own; there each worker process already takes a share of the fan-out chunks,
+# so encryption simply stays inline. Threads/solo workers and management
+# commands get the pool.
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import BrokenExecutor, CancelledError, ProcessPoolExecutor
+
+from django.conf import settings
+from pywebpush import WebPusher
+
+logger = logging.getLogger(__name__)
+
+ENCRYPT_BATCH_SIZE = 64
+
+# Raised by submit()/result() when the pool itself is unusable
+POOL_ERRORS = (BrokenExecutor, CancelledError, RuntimeError)
+
+
+def encrypt_payload(subscription_data, payload):
+    """The aes128gcm body for one subscription; raises like WebPusher.encode."""
+    return WebPusher(subscription_data).encode(payload, 'aes128gcm')['body']
+
+
+def encrypt_batch(subscriptions_data, payload):
+    """
+    Runs in a pool process: encrypt payload for each subscription. Returns
+    (bodies, seconds), with None for any subscription that could not be
+    encrypted so the sender retries it inline and reports the error.
+    """
+    start = time.perf_counter()
+    bodies = []
+    for subscription_data in subscriptions_data:
+        try:
+            bodies.append(encrypt_payload(subscription_data, payload))
+        except Exception:
+            bodies.append(None)
+    return bodies, time.perf_counter() - start
+
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+
+def pool_size(processes=None):
+    processes = processes if processes is not None else settings.PUSH_ENCRYPT_PROCESSES
+    return processes or os.cpu_count() or 1
+
+
+def encryption_pool():
+    """
+    This process's encryption pool, or None when encryption should stay
+    inline: PUSH_ENCRYPT_PROCESSES is 1, or we are a daemonic process.
+    """
+    global _pool, _pool_pid
+    if pool_size() <= 1 or multiprocessing.current_process().daemon:
+        return None
+    if _pool_pid == os.getpid():
+        return _pool
+    with _lock:
+        if _pool_pid != os.getpid():
+            # spawn, not fork: the parent has send threads and open sockets
+            _pool = ProcessPoolExecutor(pool_size(), mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+            atexit.register(_pool.shutdown, cancel_futures=True)
+        return _pool
+
+
+def discard_pool(pool):
+    """
+    Forget a broken pool (a child was OOM-killed or crashed) so the next
+    fan-out in this process starts a fresh one instead of failing too.
+    """
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is pool:
+            _pool, _pool_pid = None, None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def pre_encrypt(subscriptions, payload, timer, pool=None, batch_size=ENCRYPT_BATCH_SIZE):
+    """
+    Yield (subscription, body) for each subscription, in order, with body
+    encrypted ahead on the pool. A bounded number of batches is in flight, so
+    a lazy iterator of subscriptions is still consumed as the caller goes.
+    Yields body None (encrypt inline) when there is no pool or the audience
+    is smaller than one batch.
+    """
+    pool = pool if pool is not None else encryption_pool()
+    iterator = iter(subscriptions)
+    batch = [subscription for _, subscription in zip(range(batch_size), iterator)]
+    if pool is None or len(batch) < batch_size:
+        for subscription in batch:
+            yield subscription, None
+        for subscription in iterator:
+            yield subscription, None
+        return
+
+    window = deque()
+    max_in_flight = pool_size() * 2
+    while batch or window:
+        if batch:
+            try:
+                future = pool.submit(encrypt_batch, [s.subscription_json for s in batch], payload)
+            except POOL_ERRORS as e:
+                yield from fall_back_inline(pool, e, window, batch, iterator)
+                return
+            window.append((batch, future))
+            batch = [subscription for _, subscription in zip(range(batch_size), iterator)]
+        # Keep the pool busy; hand out the oldest batch once it is done
+        if window and (len(window) >= max_in_flight or not batch or window[0][1].done()):
+            try:
+                bodies, seconds = window[0][1].result()
+            except POOL_ERRORS as e:
+                yield from fall_back_inline(pool, e, window, batch, iterator)
+                return
+            done_batch, _ = window.popleft()
+            timer.add('encrypt', seconds, len(done_batch))
+            yield from zip(done_batch, bodies)
+
+
+def fall_back_inline(pool, error, window, batch, iterator):
+    # A pool child died (OOM kill, crash) or the pool was shut down: drop the
+    # pool and let the senders encrypt everything not handed out yet
+    logger.warning("Encryption pool failed, encrypting inline", extra={'error': repr(error)})
+    discard_pool(pool)
+    for pending_batch, _ in window:
+        for subscription in pending_batch:
+            yield subscription, None
+    for subscription in batch:
+        yield subscription, None
+    for subscription in iterator:
+        yield subscription, None
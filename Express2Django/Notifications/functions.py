@@ -0,0 +1,26 @@
+# In Notifications/functions.py
+from django.db.models import BigIntegerField, Func
+
+
+class EpochMillis(Func):
+    """
+    A datetime column as integer milliseconds since the Unix epoch - the form
+    JavaScript's Date wants - computed by the database instead of in Python.
+    """
+    output_field = BigIntegerField()
+    template = 'CAST(ROUND(EXTRACT(EPOCH FROM %(expressions)s) * 1000) AS BIGINT)'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Django stores UTC text; 2440587.5 is the Julian day of 1970-01-01
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400000) AS INTEGER)',
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(ROUND(UNIX_TIMESTAMP(%(expressions)s) * 1000) AS SIGNED)',
+            **extra_context,
+        )
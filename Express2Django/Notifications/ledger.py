@@ -0,0 +1,104 @@
+# In Notifications/ledger.py
+#
+# The Delivery table records, per notification occurrence and subscription,
+# whether a push went out. Tasks claim rows before sending and record the
+# outcome after, in bulk, so:
+#   - a chunk redelivered after a worker crash only sends the remainder,
+#   - a second dispatcher racing the first finds nothing left to claim,
+#   - retries only touch the rows that are actually waiting to retry.
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Delivery
+
+LEDGER_BATCH_SIZE = 1000
+
+
+def claim_deliveries(notification_id, occurrence, subscription_ids, statuses):
+    """
+    Create any missing ledger rows for these subscriptions, then claim the ones
+    in `statuses` (plus claims abandoned for PUSH_DELIVERY_CLAIM_TIMEOUT).
+
+    Returns (claim token, claimed subscription ids, ids still being sent by
+    another task).
+    """
+    now = timezone.now()
+    Delivery.objects.bulk_create(
+        [
+            Delivery(notification_id=notification_id, occurrence=occurrence, subscription_id=subscription_id)
+            for subscription_id in subscription_ids
+        ],
+        ignore_conflicts=True,
+        batch_size=LEDGER_BATCH_SIZE,
+    )
+
+    rows = Delivery.objects.filter(
+        notification_id=notification_id, occurrence=occurrence, subscription_id__in=subscription_ids
+    )
+    stale_before = now - timedelta(seconds=settings.PUSH_DELIVERY_CLAIM_TIMEOUT)
+    claim = uuid.uuid4().hex
+    # One conditional UPDATE: whoever flips a row to "sending" owns it
+    rows.filter(
+        Q(status__in=statuses) | Q(status=Delivery.SENDING, claimed_at__lt=stale_before)
+    ).update(
+        status=Delivery.SENDING, claim=claim, claimed_at=now, attempt=F('attempt') + 1, updated_at=now
+    )
+
+    claimed, in_flight = [], []
+    for subscription_id, status, row_claim in rows.values_list('subscription_id', 'status', 'claim'):
+        if row_claim == claim:
+            claimed.append(subscription_id)
+        elif status == Delivery.SENDING:
+            in_flight.append(subscription_id)
+    return claim, claimed, in_flight
+
+
+def record_outcomes(claim, results, retrying_ids):
+    """
+    Write back what happened to a claimed batch: one UPDATE per outcome.
+    Expired subscriptions are deleted elsewhere, taking their rows with them.
+    """
+    sent, failed, retrying = [], [], []
+    for result in results:
+        if result.ok:
+            sent.append(result.subscription_id)
+        elif result.subscription_id in retrying_ids:
+            retrying.append(result.subscription_id)
+        elif not result.expired:
+            failed.append(result.subscription_id)
+
+    now = timezone.now()
+    for status, subscription_ids in ((Delivery.SENT, sent), (Delivery.FAILED, failed), (Delivery.RETRYING, retrying)):
+        if subscription_ids:
+            Delivery.objects.filter(claim=claim, subscription_id__in=subscription_ids).update(
+                status=status, claim=None, updated_at=now
+            )
+
+
+def release_claim(claim, status):
+    """
+    Hand back whatever a failed task still holds under `claim` (rows it never
+    got to record) as `status`, and return their subscription ids.
+    """
+    rows = Delivery.objects.filter(claim=claim, status=Delivery.SENDING)
+    subscription_ids = list(rows.values_list('subscription_id', flat=True))
+    if subscription_ids:
+        Delivery.objects.filter(claim=claim, subscription_id__in=subscription_ids).update(
+            status=status, claim=None, updated_at=timezone.now()
+        )
+    return subscription_ids
+
+
+def prune_ledger(older_than, batch_size=LEDGER_BATCH_SIZE):
+    """Delete settled ledger rows last touched before `older_than`."""
+    deleted = 0
+    settled = Delivery.objects.filter(status__in=[Delivery.SENT, Delivery.FAILED], updated_at__lt=older_than)
+    while True:
+        ids = list(settled.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Delivery.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,46 @@
+# Shared helpers for the benchmark management commands (not a command itself)
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def throwaway_database(verbosity=0):
+    """
+    Run against a freshly migrated test database and destroy it afterwards, so
+    benchmarks can seed millions of rows without touching real data.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def time_calls(fn, repeat):
+    """Call fn `repeat` times and return the individual timings in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings):
+    return (
+        f"p50={statistics.median(timings):.2f}ms "
+        f"p99={percentile(timings, 99):.2f}ms "
+        f"min={min(timings):.2f}ms"
+    )
@@ -0,0 +1,181 @@
+import base64
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from Express2Django.celery import app
+from Notifications.connections import close_sessions
+from Notifications.models import Notification, PushSubscription
+from Notifications.tasks import check_pending_notifications, send_push_notification
+from ._benchutils import percentile, summarize, throwaway_database
+
+
+class FakePushService:
+    """
+    A local stand-in for a Web Push endpoint. Every POST waits `latency_ms`
+    (+/- `jitter_ms`), then answers 201, or 500 / 410 at the given rates.
+    """
+
+    def __init__(self, latency_ms, jitter_ms, error_rate, gone_rate):
+        service = self
+        self.lock = threading.Lock()
+        self.statuses = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like real push services
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                delay = max(latency_ms + random.uniform(-jitter_ms, jitter_ms), 0)
+                time.sleep(delay / 1000)
+                roll = random.random()
+                status = 500 if roll < error_rate else 410 if roll < error_rate + gone_rate else 201
+                with service.lock:
+                    service.statuses[status] = service.statuses.get(status, 0) + 1
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.origin = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def subscription_keys():
+    # Any valid P-256 key will do; sharing one keeps seeding fast, while each
+    # push is still encrypted separately
+    key = ec.generate_private_key(ec.SECP256R1())
+    public = key.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    encode = lambda raw: base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+    return {'p256dh': encode(public), 'auth': encode(os.urandom(16))}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks push delivery end to end against local fake push services: '
+        'send_push_notification and check_pending_notifications, run in-process'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscriptions', type=int, default=1000, help='Subscriptions to seed (N)')
+        parser.add_argument('--notifications', type=int, default=10, help='Notifications per phase (M)')
+        parser.add_argument('--services', type=int, default=3, help='Fake push services to spread subscriptions over')
+        parser.add_argument('--latency-ms', type=float, default=20, help='Fake push service response time')
+        parser.add_argument('--jitter-ms', type=float, default=5)
+        parser.add_argument('--error-rate', type=float, default=0.01, help='Fraction of pushes answered 500')
+        parser.add_argument('--gone-rate', type=float, default=0.0, help='Fraction of pushes answered 410')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        # Run Celery tasks (chunks, chords, scanner groups) inline
+        app.conf.task_always_eager = True
+        # Per-chunk log lines would swamp the report
+        for name in ('Notifications', 'celery'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        with ExitStack() as stack:
+            services = [
+                stack.enter_context(FakePushService(
+                    options['latency_ms'], options['jitter_ms'], options['error_rate'], options['gone_rate']
+                ))
+                for _ in range(options['services'])
+            ]
+            stack.callback(close_sessions)
+            with throwaway_database():
+                self.seed_subscriptions(options['subscriptions'], services)
+                self.bench_send(options['notifications'])
+                self.bench_scanner(options['notifications'])
+
+        statuses = {}
+        for service in services:
+            for status, count in service.statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+        self.stdout.write(f"Push service responses: {dict(sorted(statuses.items()))}")
+
+    def seed_subscriptions(self, count, services):
+        keys = subscription_keys()
+        self.stdout.write(f"Seeding {count} subscriptions over {len(services)} push services...")
+        PushSubscription.objects.bulk_create(
+            [
+                PushSubscription(
+                    subscription_json={'endpoint': f"{services[i % len(services)].origin}/push/{i}", 'keys': keys},
+                    endpoint=f"{services[i % len(services)].origin}/push/{i}",
+                )
+                for i in range(count)
+            ],
+            batch_size=2000,
+        )
+
+    def seed_notifications(self, count):
+        # Due a moment ago, addressed to every (anonymous) subscription
+        due = timezone.now() - timedelta(seconds=1)
+        return Notification.objects.bulk_create(
+            [Notification(title=f'Benchmark {i}', body='x' * 80, scheduled_time=due) for i in range(count)]
+        )
+
+    def audience(self):
+        return PushSubscription.objects.count()
+
+    def bench_send(self, count):
+        notifications = self.seed_notifications(count)
+        timings, queries, pushes = [], [], 0
+        started = time.perf_counter()
+        for notification in notifications:
+            audience = self.audience()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                send_push_notification(notification.id)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+            pushes += audience
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.MIGRATE_HEADING('send_push_notification'))
+        self.stdout.write(f"  {count} notifications, {pushes} pushes in {elapsed:.2f}s ({pushes / elapsed:.0f} pushes/s)")
+        self.stdout.write(f"  per notification: {summarize(timings)}")
+        self.stdout.write(
+            f"  queries per notification: p50={percentile(queries, 50)} max={max(queries)} "
+            f"(audience now {self.audience()})"
+        )
+
+    def bench_scanner(self, count):
+        self.seed_notifications(count)
+        audience = self.audience()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            check_pending_notifications()
+            elapsed = time.perf_counter() - start
+        pushes = audience * count
+
+        self.stdout.write(self.style.MIGRATE_HEADING('check_pending_notifications (scan + eager delivery)'))
+        self.stdout.write(f"  {count} due notifications, ~{pushes} pushes in {elapsed:.2f}s ({pushes / elapsed:.0f} pushes/s)")
+        self.stdout.write(f"  queries: {len(captured)} ({len(captured) / count:.1f} per notification)")
+        remaining = Notification.objects.filter(sent=False).count()
+        if remaining:
+            self.stderr.write(f"  {remaining} notifications left unsent")
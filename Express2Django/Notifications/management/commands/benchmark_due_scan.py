@@ -0,0 +1,86 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from Notifications.models import Notification
+from ._benchutils import summarize, throwaway_database, time_calls
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the due-notification and per-user scans with and without their indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Notification rows to seed')
+        parser.add_argument('--users', type=int, default=1000, help='Users to spread rows across')
+        parser.add_argument('--pending', type=float, default=0.02, help='Fraction of rows still unsent')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with throwaway_database():
+            self.seed(options)
+            now = timezone.now()
+            user_id = Notification.objects.exclude(user=None).values_list('user', flat=True).first()
+            user = User.objects.get(id=user_id)
+
+            queries = {
+                'due scan': lambda: list(Notification.objects.due(now).values_list('id', flat=True)),
+                'user pending': lambda: list(
+                    Notification.objects.pending_for(user).values_list('id', 'scheduled_time')
+                ),
+            }
+
+            self.stdout.write(self.style.MIGRATE_HEADING('With indexes'))
+            self.run(queries, options['repeat'], explain=True)
+
+            with connection.schema_editor() as editor:
+                for index in Notification._meta.indexes:
+                    editor.remove_index(Notification, index)
+
+            self.stdout.write(self.style.MIGRATE_HEADING('Without indexes'))
+            self.run(queries, options['repeat'], explain=True)
+
+    def seed(self, options):
+        rows, pending = options['rows'], options['pending']
+        users = User.objects.bulk_create(
+            [User(username=f'bench{i}', password='!') for i in range(options['users'])]
+        )
+        now = timezone.now()
+        self.stdout.write(f"Seeding {rows} notifications...")
+
+        batch = []
+        for i in range(rows):
+            is_pending = random.random() < pending
+            # History lives in the past year; pending rows straddle "now"
+            offset = random.uniform(-1, 1) if is_pending else random.uniform(-365, 0)
+            batch.append(Notification(
+                user=users[i % len(users)] if i % 10 else None,
+                title=f'Benchmark {i}',
+                body='x' * 80,
+                scheduled_time=now + timedelta(days=offset),
+                sent=not is_pending,
+            ))
+            if len(batch) >= 10_000:
+                Notification.objects.bulk_create(batch)
+                batch = []
+        Notification.objects.bulk_create(batch)
+
+        # Let the planner see the new data
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def run(self, queries, repeat, explain=False):
+        for name, query in queries.items():
+            rows = len(query())
+            timings = time_calls(query, repeat)
+            self.stdout.write(f"  {name:<14} rows={rows:<8} {summarize(timings)}")
+
+        if explain:
+            now = timezone.now()
+            plan = Notification.objects.due(now).values_list('id', flat=True).explain()
+            self.stdout.write(f"  due scan plan: {plan}")
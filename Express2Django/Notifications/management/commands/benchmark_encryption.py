@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from Notifications.encryption import ENCRYPT_BATCH_SIZE, encrypt_payload, pre_encrypt
+from Notifications.timing import StageTimer
+from .benchmark_delivery import subscription_keys
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks Web Push payload encryption (ECDH + aes128gcm per subscription): '
+        'inline on one core, then on the encryption pool at each process count'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payloads', type=int, default=5000, help='Subscriptions to encrypt for per run')
+        parser.add_argument('--payload-bytes', type=int, default=200, help='Plaintext size')
+        parser.add_argument(
+            '--processes', default=None,
+            help='Comma-separated pool sizes to try (default: 2 up to the core count)',
+        )
+        parser.add_argument('--batch-size', type=int, default=ENCRYPT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        cores = os.cpu_count() or 1
+        if options['processes']:
+            sizes = [int(size) for size in options['processes'].split(',')]
+        else:
+            sizes = list(range(2, cores + 1)) or [2]
+        count = options['payloads']
+        payload = os.urandom(options['payload_bytes'])
+        subscription_data = {'endpoint': 'https://push.invalid/x', 'keys': subscription_keys()}
+        subscriptions = [SimpleNamespace(subscription_json=subscription_data) for _ in range(count)]
+
+        self.stdout.write(f"{count} payloads of {len(payload)} bytes, {cores} cores")
+        start = time.perf_counter()
+        for _ in range(count):
+            encrypt_payload(subscription_data, payload)
+        inline = count / (time.perf_counter() - start)
+        self.stdout.write(f"  inline:       {inline:8.0f} payloads/s")
+
+        for size in sizes:
+            with ProcessPoolExecutor(size, mp_context=multiprocessing.get_context('spawn')) as pool:
+                # Warm up: spawn the processes and import pywebpush in each
+                list(pool.map(encrypt_payload, [subscription_data] * size, [payload] * size))
+                timer = StageTimer()
+                start = time.perf_counter()
+                encrypted = sum(
+                    body is not None
+                    for _, body in pre_encrypt(subscriptions, payload, timer, pool, options['batch_size'])
+                )
+                rate = count / (time.perf_counter() - start)
+            self.stdout.write(
+                f"  {size:2d} processes: {rate:8.0f} payloads/s, {rate / min(size, cores):6.0f} per core, "
+                f"{rate / inline:4.1f}x inline ({encrypted}/{count} encrypted)"
+            )
@@ -0,0 +1,62 @@
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from ._benchutils import summarize
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammers a running server with concurrent GETs and reports throughput and latency. '
+        'Run it once against SERVER_MODE=asgi and once against SERVER_MODE=wsgi to compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='e.g. http://localhost:8000/api/get-scheduled-notifications')
+        parser.add_argument('--concurrency', type=int, default=50, help='Simultaneous clients')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--cookie', default='', help='Cookie header, e.g. "sessionid=..." for login-only views')
+
+    def handle(self, *args, **options):
+        headers = {'Cookie': options['cookie']} if options['cookie'] else {}
+        deadline = time.monotonic() + options['duration']
+        lock = threading.Lock()
+        timings, statuses = [], {}
+
+        def client():
+            while time.monotonic() < deadline:
+                request = urllib.request.Request(options['url'], headers=headers)
+                start = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(request, timeout=options['timeout']) as response:
+                        response.read()
+                        status = response.status
+                except urllib.error.HTTPError as e:
+                    status = e.code
+                except OSError as e:
+                    status = type(e).__name__
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    timings.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for _ in range(options['concurrency']):
+                pool.submit(client)
+        wall = time.perf_counter() - started
+
+        if not timings:
+            self.stderr.write("No requests completed")
+            return
+        self.stdout.write(
+            f"{len(timings)} requests in {wall:.1f}s ({len(timings) / wall:.1f} req/s) "
+            f"with {options['concurrency']} clients"
+        )
+        self.stdout.write(f"latency {summarize(timings)}")
+        self.stdout.write(f"statuses {statuses}")
@@ -0,0 +1,46 @@
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_slug
+
+from Notifications.models import PushSubscription
+from Notifications.topics import set_members
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads a segment into a topic: reads user ids (one per line) from a file or stdin '
+        'and makes the topic contain exactly those users\' subscriptions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic', help='Topic name, created if missing')
+        parser.add_argument('--file', help='File of user ids; defaults to stdin')
+
+    def handle(self, *args, **options):
+        try:
+            # Topic names appear in URLs as <slug:name>
+            validate_slug(options['topic'])
+        except ValidationError:
+            raise CommandError(f"Topic names may only use letters, numbers, '-' and '_': {options['topic']!r}")
+
+        source = open(options['file']) if options['file'] else sys.stdin
+        try:
+            with source:
+                user_ids = {int(line) for line in source if line.strip()}
+        except ValueError as e:
+            raise CommandError(f"Not a user id: {e}")
+
+        subscription_ids = []
+        ids = sorted(user_ids)
+        for start in range(0, len(ids), 1000):
+            subscription_ids.extend(
+                PushSubscription.objects.filter(user_id__in=ids[start:start + 1000]).values_list('id', flat=True)
+            )
+
+        topic, added, removed = set_members(options['topic'], subscription_ids)
+        self.stdout.write(
+            f"{topic.name}: {len(subscription_ids)} subscriptions from {len(user_ids)} users "
+            f"({added} added, {removed} removed)"
+        )
@@ -0,0 +1,202 @@
+# In Notifications/metrics.py
+#
+# Prometheus metrics for delivery. Web and Celery processes are forked, so when
+# PROMETHEUS_MULTIPROC_DIR is set every process writes its samples to files in
+# that directory and a scrape adds them up (prometheus_client multiprocess
+# mode). Without it - runserver, a shell - metrics live in the process.
+#
+# Each deployment (web, worker) gets its own directory: the web service serves
+# /metrics, and Celery workers serve theirs on CELERY_METRICS_PORT.
+import os
+import shutil
+from urllib.parse import urlparse
+
+from celery.signals import worker_init, worker_process_shutdown
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from .models import Notification
+from .scheduler import bucket_end
+
+SEND_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LATENESS_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+PUSH_SENDS = Counter(
+    'push_sends_total',
+    'Push requests by push service and outcome (sent, failed, expired, transient)',
+    ['push_service', 'outcome'],
+)
+PUSH_SEND_SECONDS = Histogram(
+    'push_send_seconds',
+    'Time to encrypt and send one push, by push service',
+    ['push_service'],
+    buckets=SEND_LATENCY_BUCKETS,
+)
+NOTIFICATION_LATENESS_SECONDS = Histogram(
+    'notification_lateness_seconds',
+    'How long after its scheduled_time a notification started sending',
+    buckets=LATENESS_BUCKETS,
+)
+PUSH_CHUNK_SECONDS = Histogram(
+    'push_chunk_seconds',
+    'Wall time of one send_push_chunk task',
+    buckets=SEND_LATENCY_BUCKETS,
+)
+NOTIFICATIONS_SENT = Counter(
+    'notifications_sent_total',
+    'Notification occurrences claimed for sending',
+)
+NOTIFICATIONS_DISPATCHED = Counter(
+    'notifications_dispatched_total',
+    'Notifications claimed and queued by the beat scanner',
+)
+NOTIFICATIONS_SCHEDULED = Counter(
+    'notifications_scheduled_total',
+    'Notifications created through the API',
+    ['endpoint'],
+)
+REMOTE_LOG_RECORDS = Counter(
+    'remote_log_records_total',
+    'Client log records by outcome: accepted or dropped (buffer full) on '
+    'arrival, then flushed to the sink or failed (lost to a sink error)',
+    ['outcome'],
+)
+REMOTE_LOG_SINK_ERRORS = Counter(
+    'remote_log_sink_errors_total',
+    'Remote-log flushes that raised in the sink',
+)
+
+
+# Hostname suffix -> label for the push services browsers use. Endpoints come
+# from clients, so any other host is "other" rather than a label of its own
+PUSH_SERVICES = (
+    ('fcm.googleapis.com', 'fcm'),
+    ('android.googleapis.com', 'fcm'),
+    ('push.services.mozilla.com', 'mozilla'),
+    ('push.apple.com', 'apple'),
+    ('notify.windows.com', 'wns'),
+)
+
+
+def push_service(origin):
+    host = urlparse(origin).hostname or ''
+    for suffix, label in PUSH_SERVICES:
+        if host == suffix or host.endswith('.' + suffix):
+            return label
+    return 'other'
+
+
+def observe_send(result, seconds):
+    service = push_service(result.origin)
+    if result.ok:
+        outcome = 'sent'
+    elif result.expired:
+        outcome = 'expired'
+    else:
+        outcome = 'transient' if result.transient else 'failed'
+    PUSH_SENDS.labels(service, outcome).inc()
+    if seconds is not None:
+        PUSH_SEND_SECONDS.labels(service).observe(seconds)
+
+
+def observe_lateness(scheduled_time, now=None):
+    now = now or timezone.now()
+    NOTIFICATION_LATENESS_SECONDS.observe(max((now - scheduled_time).total_seconds(), 0))
+
+
+class QueueDepthCollector:
+    """
+    Backlog gauges read at scrape time, so they are right however many
+    processes there are: notifications due but not yet queued, queued but not
+    yet sent, and messages waiting in the Celery broker.
+    """
+
+    def collect(self):
+        close_old_connections()
+        now = timezone.now()
+        due = Notification.objects.due(now)
+        yield GaugeMetricFamily(
+            'notifications_due_unclaimed',
+            'Due notifications the scanner has not queued yet',
+            value=due.filter(dispatched_at__isnull=True).count(),
+        )
+        yield GaugeMetricFamily(
+            'notifications_queued',
+            'Notifications queued by the scanner and not sent yet',
+            # Claims only ever cover the current bucket, which bounds the scan
+            value=Notification.objects.due(bucket_end(now)).filter(dispatched_at__isnull=False).count(),
+        )
+        oldest = due.values_list('scheduled_time', flat=True).first()
+        yield GaugeMetricFamily(
+            'notifications_oldest_due_seconds',
+            'Age of the oldest due, unsent notification',
+            value=(now - oldest).total_seconds() if oldest else 0,
+        )
+        depth = broker_queue_length()
+        if depth is not None:
+            yield GaugeMetricFamily('celery_queue_length', 'Messages waiting in the default Celery queue', value=depth)
+
+
+def broker_queue_length():
+    # Only Redis brokers keep the queue as a list we can measure
+    if not settings.CELERY_BROKER_URL.startswith(('redis://', 'rediss://')):
+        return None
+    try:
+        import redis
+        client = redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_timeout=1)
+        return client.llen('celery')
+    except Exception:
+        return None
+
+
+class ProcessMetrics:
+    # Single-process fallback: re-expose the default registry's samples
+    def collect(self):
+        return REGISTRY.collect()
+
+
+def scrape_registry(backlog=True):
+    """A registry holding every process's samples, plus the backlog gauges."""
+    registry = CollectorRegistry()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(ProcessMetrics())
+    if backlog:
+        registry.register(QueueDepthCollector())
+    return registry
+
+
+def clear_multiprocess_dir():
+    # Samples from a previous run would otherwise be added to this one's
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path and os.path.isdir(path):
+        for name in os.listdir(path):
+            full_path = os.path.join(path, name)
+            if os.path.isdir(full_path):
+                shutil.rmtree(full_path)
+            else:
+                os.remove(full_path)
+
+
+def mark_process_dead(pid):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+@worker_init.connect
+def _start_worker_metrics(**kwargs):
+    # Runs in the Celery parent before the pool forks
+    clear_multiprocess_dir()
+    if settings.CELERY_METRICS_PORT:
+        from prometheus_client import start_http_server
+        # The web /metrics already reports the backlog
+        start_http_server(settings.CELERY_METRICS_PORT, registry=scrape_registry(backlog=False))
+
+
+@worker_process_shutdown.connect
+def _mark_worker_dead(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
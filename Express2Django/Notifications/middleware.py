@@ -1,13 +1,27 @@
-import os
-from django.conf import settings
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
 
 class ServiceWorkerMiddleware:
+    # Runs natively under both WSGI and ASGI, so async views don't pay a
+    # thread hop for it
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        response = self.get_response(request)
-        
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
         # Check for service worker requests - handle both direct and static paths
         if request.path.endswith('/static/service-worker.js') or request.path.endswith('service-worker.js'):
             # Add the Service-Worker-Allowed header to allow controlling the entire site
@@ -16,9 +30,37 @@ class ServiceWorkerMiddleware:
             # Ensure proper content type
             response['Content-Type'] = 'application/javascript'
             
-            # Add cache control headers to prevent caching issues
-            response['Cache-Control'] = 'no-cache, no-store, must-revalidate, max-age=0'
-            response['Pragma'] = 'no-cache'
-            response['Expires'] = '0'
+            # Let browsers keep a copy but revalidate it on every update check;
+            # an unchanged script then costs a 304 instead of the full body
+            response['Cache-Control'] = 'no-cache, max-age=0'
         
-        return response
\ No newline at end of file
+        return response
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise's middleware is sync-only, which under ASGI would push every
+    request through a worker thread. This serves static files the same way but
+    passes everything else straight down the async chain.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
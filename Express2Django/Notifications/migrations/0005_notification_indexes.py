@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0004_pushsubscription_failed_attempts_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('sent', False)), fields=['scheduled_time', 'id'], name='notification_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'sent', 'scheduled_time'], name='notification_user_sent_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0006_notification_dispatched_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushsubscription',
+            name='endpoint',
+            field=models.URLField(max_length=2048, null=True, unique=True),
+        ),
+    ]
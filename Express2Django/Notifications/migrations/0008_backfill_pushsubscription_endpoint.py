@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+def backfill_endpoints(apps, schema_editor):
+    PushSubscription = apps.get_model('Notifications', 'PushSubscription')
+
+    # Newest row wins when the same endpoint was saved more than once
+    seen = set()
+    duplicates = []
+    batch = []
+    for subscription in PushSubscription.objects.order_by('-id').iterator(chunk_size=2000):
+        endpoint = (subscription.subscription_json or {}).get('endpoint')
+        if not endpoint:
+            continue
+        if endpoint in seen:
+            duplicates.append(subscription.id)
+            continue
+        seen.add(endpoint)
+        subscription.endpoint = endpoint
+        batch.append(subscription)
+
+    PushSubscription.objects.filter(id__in=duplicates).delete()
+    PushSubscription.objects.bulk_update(batch, ['endpoint'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0007_pushsubscription_endpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_endpoints, migrations.RunPython.noop),
+    ]
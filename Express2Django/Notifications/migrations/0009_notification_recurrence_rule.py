@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0008_backfill_pushsubscription_endpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='last_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='repeat_interval',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.db import migrations
+
+PERIODS = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+
+
+def collapse_chains(apps, schema_editor):
+    """
+    Recurring notifications used to be copied into a new row on every firing.
+    Fold each chain back into its unsent head, which now serves as the rule.
+
+    Rows belong to the same chain when they share user, title, body, repeat
+    and their position within the period (so "8am daily" and "8pm daily" with
+    the same text stay separate rules).
+    """
+    Notification = apps.get_model('Notifications', 'Notification')
+
+    chains = {}
+    rows = (
+        Notification.objects.filter(repeat__in=PERIODS)
+        .order_by('scheduled_time', 'id')
+        .values_list('id', 'user_id', 'title', 'body', 'repeat', 'scheduled_time', 'sent')
+    )
+    for pk, user_id, title, body, repeat, scheduled_time, sent in rows.iterator(chunk_size=2000):
+        period = PERIODS[repeat].total_seconds()
+        phase = int(scheduled_time.timestamp()) % int(period)
+        chain = chains.setdefault((user_id, title, body, repeat, phase), [])
+        chain.append((pk, scheduled_time, sent))
+
+    to_delete = []
+    for chain in chains.values():
+        unsent = [row for row in chain if not row[2]]
+        fired = [row for row in chain if row[2]]
+        # The latest unsent row is the live cursor; a chain with none left
+        # keeps only its most recent firing
+        head = unsent[-1] if unsent else chain[-1]
+        to_delete.extend(pk for pk, _, _ in chain if pk != head[0])
+        if unsent and fired:
+            Notification.objects.filter(id=head[0]).update(last_sent_at=fired[-1][1])
+
+    for start in range(0, len(to_delete), 2000):
+        Notification.objects.filter(id__in=to_delete[start:start + 2000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0009_notification_recurrence_rule'),
+    ]
+
+    operations = [
+        # The deleted rows were copies of past firings and are not restored;
+        # migrating back leaves each chain as its one head row
+        migrations.RunPython(collapse_chains, migrations.RunPython.noop),
+    ]
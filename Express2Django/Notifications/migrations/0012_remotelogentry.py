@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0011_changecounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemoteLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField(db_index=True)),
+                ('client_timestamp', models.CharField(blank=True, max_length=64)),
+                ('user_agent', models.CharField(blank=True, max_length=512)),
+                ('level', models.CharField(default='log', max_length=16)),
+                ('message', models.TextField()),
+                ('data', models.JSONField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0012_remotelogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Delivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('occurrence', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('retrying', 'Waiting to retry'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempt', models.PositiveSmallIntegerField(default=0)),
+                ('claim', models.CharField(blank=True, db_index=True, max_length=32, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Notifications.notification')),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Notifications.pushsubscription')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='delivery_updated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('notification', 'occurrence', 'subscription'), name='delivery_unique')],
+            },
+        ),
+    ]
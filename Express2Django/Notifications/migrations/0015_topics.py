@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0014_notification_updated_at_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Topic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.SlugField(max_length=100, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='topic',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='Notifications.topic'),
+        ),
+        migrations.CreateModel(
+            name='TopicMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Notifications.pushsubscription')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Notifications.topic')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('topic', 'subscription'), name='topic_membership_unique')],
+            },
+        ),
+    ]
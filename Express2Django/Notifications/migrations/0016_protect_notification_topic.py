@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0015_topics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='topic',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='Notifications.topic'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Notifications', '0016_protect_notification_topic'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='delivery',
+            name='notification',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='Notifications.notification'),
+        ),
+    ]
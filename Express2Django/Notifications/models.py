@@ -6,13 +6,61 @@ from django.utils import timezone  # Added import for timezone
 class PushSubscription(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     subscription_json = models.JSONField()
+    endpoint = models.URLField(max_length=2048, null=True, unique=True)  # Copied out of subscription_json for upserts
     created_at = models.DateTimeField(auto_now_add=True)
     last_successful_push = models.DateTimeField(null=True, blank=True)  # Track last successful push
     failed_attempts = models.IntegerField(default=0)  # Track failed attempts
 
+    def save(self, *args, **kwargs):
+        if not self.endpoint:
+            self.endpoint = self.subscription_json.get('endpoint')
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Subscription for {self.user or 'Anonymous'}"
 
+class Topic(models.Model):
+    """
+    A named audience ("news", "trial-ending") that subscriptions join.
+    A notification with a topic goes to every member instead of one user's
+    devices, so a broadcast is one row and one fan-out.
+    """
+    name = models.SlugField(max_length=100, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+class TopicMembership(models.Model):
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+    subscription = models.ForeignKey(PushSubscription, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Also the index the fan-out walks: one topic's members in id order
+            models.UniqueConstraint(fields=['topic', 'subscription'], name='topic_membership_unique'),
+        ]
+
+    def __str__(self):
+        return f"Subscription {self.subscription_id} in {self.topic_id}"
+
+class NotificationQuerySet(models.QuerySet):
+    def due(self, now):
+        # Matches notification_due_idx: unsent rows in scheduled order
+        return self.filter(sent=False, scheduled_time__lte=now).order_by('scheduled_time', 'id')
+
+    def owned_by(self, user):
+        # The caller's own notifications; anonymous rows are user=NULL. Topic
+        # broadcasts keep their creator in user but belong to the audience,
+        # so they never show up (or get acknowledged away) as the creator's
+        user = user if user is not None and user.is_authenticated else None
+        return self.filter(user=user, topic__isnull=True)
+
+    def pending_for(self, user):
+        # Matches notification_user_sent_idx
+        return self.owned_by(user).filter(sent=False).order_by('scheduled_time', 'id')
+
 class Notification(models.Model):
     REPEAT_CHOICES = [
         ('none', 'No repeat'),
@@ -21,12 +69,122 @@ class Notification(models.Model):
     ]
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    topic = models.ForeignKey(Topic, on_delete=models.PROTECT, null=True, blank=True)  # Broadcast to a topic instead of the user's devices; user is then its creator
     title = models.CharField(max_length=255)
     body = models.TextField()
-    scheduled_time = models.DateTimeField()
+    scheduled_time = models.DateTimeField()  # Next firing for recurring notifications
     repeat = models.CharField(max_length=10, choices=REPEAT_CHOICES, default='none')
+    repeat_interval = models.PositiveIntegerField(default=1)  # Every N days/weeks
     sent = models.BooleanField(default=False)  # Added field to track if notification has been sent
+    dispatched_at = models.DateTimeField(null=True, blank=True)  # Claimed by the scanner and queued
+    last_sent_at = models.DateTimeField(null=True, blank=True)  # Last firing of a recurring notification
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Set explicitly in queryset .update() calls too
+
+    objects = NotificationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Due scan in check_pending_notifications: only unsent rows, in time
+            # order, with the id in the index so the scan never touches the table
+            models.Index(
+                fields=['scheduled_time', 'id'],
+                condition=models.Q(sent=False),
+                name='notification_due_idx',
+            ),
+            # Per-user listing in get_scheduled_notifications
+            models.Index(fields=['user', 'sent', 'scheduled_time'], name='notification_user_sent_idx'),
+            # Delta sync in notification_changes
+            models.Index(fields=['user', 'updated_at', 'id'], name='notification_user_updated_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.title} at {self.scheduled_time}"
\ No newline at end of file
+        return f"{self.title} at {self.scheduled_time}"
+
+class ChangeCounter(models.Model):
+    """
+    Version number per notification audience ("user:<id>" or "anonymous"),
+    bumped whenever that audience's pending notifications change. Used to
+    answer conditional GETs without running the list query.
+    """
+    scope = models.CharField(max_length=64, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
+class NotificationTombstone(models.Model):
+    """
+    Left behind when a notification is deleted so delta-syncing clients learn
+    about it. Pruned after NOTIFICATION_TOMBSTONE_RETENTION_DAYS; clients whose
+    cursor is older than that get a full resync instead.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    notification_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"Notification {self.notification_id} deleted at {self.deleted_at}"
+
+class Delivery(models.Model):
+    """
+    Ledger of one notification occurrence sent to one subscription. The unique
+    row makes every send claimable exactly once, so overlapping dispatchers,
+    redelivered chunks and retries never push the same occurrence twice.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    RETRYING = 'retrying'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (RETRYING, 'Waiting to retry'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Not a constraint and not cascaded: deleting a notification mid fan-out
+    # must not take the record of what was already sent with it
+    notification = models.ForeignKey(Notification, on_delete=models.DO_NOTHING, db_constraint=False)
+    occurrence = models.DateTimeField()  # scheduled_time of the firing; recurring rules have many
+    subscription = models.ForeignKey(PushSubscription, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempt = models.PositiveSmallIntegerField(default=0)
+    claim = models.CharField(max_length=32, null=True, blank=True, db_index=True)  # Token of the task sending it
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['notification', 'occurrence', 'subscription'],
+                name='delivery_unique',
+            ),
+        ]
+        indexes = [
+            # Ledger pruning in prune_deliveries
+            models.Index(fields=['updated_at'], name='delivery_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"Notification {self.notification_id} -> subscription {self.subscription_id}: {self.status}"
+
+class RemoteLogEntry(models.Model):
+    # Client-side debug log lines, written in batches by the "db" remote-log sink
+    received_at = models.DateTimeField(db_index=True)
+    client_timestamp = models.CharField(max_length=64, blank=True)
+    user_agent = models.CharField(max_length=512, blank=True)
+    level = models.CharField(max_length=16, default='log')
+    message = models.TextField()
+    data = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return f"[{self.level}] {self.message[:80]}"
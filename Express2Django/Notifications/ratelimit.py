@@ -0,0 +1,181 @@
+# In Notifications/ratelimit.py
+#
+# Token buckets per push-service origin, shared by every worker through Redis
+# so the combined send rate to one service stays under PUSH_RATE_LIMIT. A
+# service that answers 429/503 with Retry-After pauses its origin for everyone
+# until then. If Redis is unreachable each process falls back to its own
+# in-memory buckets, which still honor Retry-After locally.
+import logging
+import math
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# After a Redis error, seconds spent on the in-memory buckets before trying
+# Redis again; a dead Redis would otherwise cost every send a socket timeout
+REDIS_RETRY_INTERVAL = 30
+
+# KEYS: bucket hash, pause key. ARGV: rate per second (0 = unlimited), burst.
+# Returns 0 when a token was taken, otherwise milliseconds to wait.
+TAKE_TOKEN = """
+local paused = redis.call('PTTL', KEYS[2])
+if paused > 0 then
+    return paused
+end
+local rate = tonumber(ARGV[1])
+if rate <= 0 then
+    return 0
+end
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+# Only ever lengthens a pause. KEYS: pause key. ARGV: milliseconds.
+PAUSE = """
+if redis.call('PTTL', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], '1', 'PX', ARGV[1])
+end
+"""
+
+
+class MemoryRateLimiter:
+    """Per-process token buckets; the fallback when Redis is unavailable."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}  # origin -> [tokens, monotonic time]
+        self._paused_until = {}  # origin -> monotonic time
+
+    def try_acquire(self, origin):
+        """Take a token for origin; return 0, or the seconds to wait first."""
+        now = time.monotonic()
+        with self._lock:
+            paused = self._paused_until.get(origin, 0) - now
+            if paused > 0:
+                return paused
+            if self.rate <= 0:
+                return 0
+            tokens, last = self._buckets.get(origin, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[origin] = [tokens - 1, now]
+                return 0
+            self._buckets[origin] = [tokens, now]
+            return (1 - tokens) / self.rate
+
+    def pause(self, origin, seconds):
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._paused_until[origin] = max(self._paused_until.get(origin, 0), until)
+
+
+class RedisRateLimiter:
+    """Token buckets in Redis, shared by every worker process and host."""
+
+    def __init__(self, client, rate, burst, fallback):
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.fallback = fallback
+        self._take = client.register_script(TAKE_TOKEN)
+        self._pause = client.register_script(PAUSE)
+        self._down_until = 0  # monotonic time; Redis is skipped until then
+
+    def keys(self, origin):
+        return f"push:ratelimit:{origin}", f"push:paused:{origin}"
+
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def try_acquire(self, origin):
+        if not self.available():
+            return self.fallback.try_acquire(origin)
+        try:
+            return self._take(keys=self.keys(origin), args=[self.rate, self.burst]) / 1000
+        except Exception as e:
+            self.mark_down(e)
+            return self.fallback.try_acquire(origin)
+
+    def pause(self, origin, seconds):
+        self.fallback.pause(origin, seconds)
+        if not self.available():
+            return
+        try:
+            self._pause(keys=self.keys(origin)[1:], args=[max(int(seconds * 1000), 1)])
+        except Exception as e:
+            self.mark_down(e)
+
+    def mark_down(self, error):
+        if self.available():
+            logger.warning("Redis rate limiter unavailable, using in-process buckets", extra={
+                'error': str(error), 'retry_in': REDIS_RETRY_INTERVAL,
+            })
+        self._down_until = time.monotonic() + REDIS_RETRY_INTERVAL
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The process-wide limiter: Redis-backed if Redis answers, else in-memory."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = build_rate_limiter()
+    return _limiter
+
+
+def build_rate_limiter():
+    memory = MemoryRateLimiter(settings.PUSH_RATE_LIMIT, settings.PUSH_RATE_BURST)
+    url = settings.PUSH_RATE_LIMIT_REDIS_URL
+    if not url:
+        return memory
+    try:
+        import redis
+        client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        client.ping()
+    except Exception as e:
+        logger.warning("Redis rate limiter unavailable, using in-process buckets", extra={'error': str(e)})
+        return memory
+    return RedisRateLimiter(client, settings.PUSH_RATE_LIMIT, settings.PUSH_RATE_BURST, memory)
+
+
+def parse_retry_after(value):
+    """
+    Retry-After as seconds; it may be delta-seconds or an HTTP date. Capped
+    at PUSH_RETRY_MAX_DELAY, and None for anything unusable ("inf", "nan").
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    if not math.isfinite(seconds):
+        return None
+    return min(max(seconds, 0), settings.PUSH_RETRY_MAX_DELAY)
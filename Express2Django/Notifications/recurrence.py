@@ -0,0 +1,33 @@
+# In Notifications/recurrence.py
+#
+# A recurring Notification is a rule (repeat + repeat_interval) whose
+# scheduled_time is the cursor for its next firing. Each firing advances the
+# cursor in place instead of copying the row.
+from datetime import timedelta
+
+# Base step for each repeat frequency; repeat_interval multiplies it
+# ("every 2 weeks"). New frequencies only need an entry here and in
+# Notification.REPEAT_CHOICES.
+FREQUENCIES = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+
+
+def is_recurring(notification):
+    return notification.repeat in FREQUENCIES
+
+
+def next_occurrence(notification, after):
+    """
+    Where to move the cursor once the occurrence at scheduled_time fires.
+
+    Occurrences that already passed by `after` (workers were down, say) are
+    skipped rather than replayed, so a rule never fires repeatedly to catch up.
+    """
+    step = FREQUENCIES[notification.repeat] * max(notification.repeat_interval, 1)
+    cursor = notification.scheduled_time
+    if cursor > after:
+        return cursor + step
+    missed = (after - cursor) // step
+    return cursor + step * (missed + 1)
@@ -0,0 +1,167 @@
+# In Notifications/remotelog.py
+#
+# Client debug logs arrive in batches and go into a bounded in-process buffer;
+# a background thread drains it to the configured sink when it fills up to
+# REMOTE_LOG_FLUSH_SIZE or every REMOTE_LOG_FLUSH_INTERVAL seconds. The request
+# only pays for an append, and a slow sink can never back up into the web
+# workers: once the buffer is full new records are dropped. Every outcome is
+# counted in remote_log_records_total (see metrics.py).
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .metrics import REMOTE_LOG_RECORDS, REMOTE_LOG_SINK_ERRORS
+from .models import RemoteLogEntry
+
+logger = logging.getLogger(__name__)
+
+
+class StdoutSink:
+    """One JSON object per line, for platforms that collect stdout."""
+
+    def write(self, records):
+        sys.stdout.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+        sys.stdout.flush()
+
+
+class FileSink:
+    """JSON lines appended to REMOTE_LOG_FILE."""
+
+    def __init__(self, path=None):
+        self.path = path or settings.REMOTE_LOG_FILE
+
+    def write(self, records):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+
+
+class DatabaseSink:
+    """RemoteLogEntry rows, one bulk insert per flush."""
+
+    def write(self, records):
+        close_old_connections()
+        try:
+            RemoteLogEntry.objects.bulk_create(
+                [RemoteLogEntry(**record) for record in records], batch_size=500
+            )
+        finally:
+            close_old_connections()
+
+
+SINKS = {
+    'stdout': StdoutSink,
+    'file': FileSink,
+    'db': DatabaseSink,
+}
+
+
+class LogBuffer:
+    def __init__(self, sink, capacity, flush_size, flush_interval):
+        self.sink = sink
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.records = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.flush_lock = threading.Lock()
+        self.flusher_pid = None
+
+    def offer(self, records):
+        """
+        Buffer as many records as fit and return (accepted, dropped). Never
+        blocks on the sink.
+        """
+        with self.lock:
+            room = max(self.capacity - len(self.records), 0)
+            accepted = records[:room]
+            self.records.extend(accepted)
+            should_flush = len(self.records) >= self.flush_size
+        REMOTE_LOG_RECORDS.labels('accepted').inc(len(accepted))
+        REMOTE_LOG_RECORDS.labels('dropped').inc(len(records) - len(accepted))
+        self.ensure_flusher()
+        if should_flush:
+            self.wakeup.set()
+        return len(accepted), len(records) - len(accepted)
+
+    def take(self):
+        with self.lock:
+            batch = list(self.records)
+            self.records.clear()
+        return batch
+
+    def flush(self):
+        # Serialized so the flusher thread and atexit never interleave writes
+        with self.flush_lock:
+            batch = self.take()
+            if not batch:
+                return 0
+            try:
+                self.sink.write(batch)
+            except Exception:
+                REMOTE_LOG_SINK_ERRORS.inc()
+                REMOTE_LOG_RECORDS.labels('failed').inc(len(batch))
+                logger.exception("Remote log sink failed", extra={'dropped': len(batch)})
+                return 0
+            REMOTE_LOG_RECORDS.labels('flushed').inc(len(batch))
+            return len(batch)
+
+    def ensure_flusher(self):
+        # Started lazily and per process, so forked web workers each get one
+        if self.flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        threading.Thread(target=self.run, name='remote-log-flusher', daemon=True).start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = LogBuffer(
+                    sink=SINKS[settings.REMOTE_LOG_SINK](),
+                    capacity=settings.REMOTE_LOG_BUFFER_SIZE,
+                    flush_size=settings.REMOTE_LOG_FLUSH_SIZE,
+                    flush_interval=settings.REMOTE_LOG_FLUSH_INTERVAL,
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def normalize(raw, user_agent):
+    """
+    Turn one client log object into a sink record. Raises ValueError for
+    anything that isn't an object with a message.
+    """
+    if not isinstance(raw, dict) or 'message' not in raw:
+        raise ValueError('Each log record must be an object with a message')
+    return {
+        'received_at': timezone.now(),
+        'client_timestamp': str(raw.get('timestamp') or '')[:64],
+        'user_agent': str(raw.get('userAgent') or user_agent or '')[:512],
+        'level': str(raw.get('level') or 'log')[:16],
+        'message': str(raw['message'])[:settings.REMOTE_LOG_MAX_MESSAGE_LENGTH],
+        'data': raw.get('data'),
+    }
@@ -0,0 +1,58 @@
+# In Notifications/routers.py
+#
+# Read routing: views wrapped in use_replica run their queries against the
+# 'replica' database; everything else, and every write, uses 'default'. The
+# choice lives in a context variable, which asgiref copies into the threads
+# that run async ORM calls, so it follows the request and nothing else.
+#
+# Only views that can tolerate replication lag belong here. notification_changes
+# does not: its cursor is based on the primary's clock, so a lagging replica
+# could make a client skip changes.
+import functools
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.db import connections
+
+REPLICA = 'replica'
+
+_read_replica = ContextVar('read_replica', default=False)
+
+
+def use_replica(view):
+    """Send the view's reads to the replica, if one is configured."""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            token = _read_replica.set(True)
+            try:
+                return await view(*args, **kwargs)
+            finally:
+                _read_replica.reset(token)
+    else:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token = _read_replica.set(True)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                _read_replica.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_replica.get() and REPLICA in connections.settings:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both sides
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica gets its schema through replication
+        return db != REPLICA
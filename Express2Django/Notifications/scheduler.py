@@ -0,0 +1,94 @@
+# In Notifications/scheduler.py
+#
+# Future notifications are not held as Celery ETA tasks. The Notification table,
+# ordered by notification_due_idx, is the sorted store of due times; once per
+# bucket the beat dispatcher claims everything due before the end of the next
+# bucket and only those get short-lived ETA tasks. Worker memory is bounded by
+# one bucket's worth of work no matter how far ahead notifications are booked.
+from datetime import timedelta
+
+from celery import group
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Notification
+
+
+def bucket_end(now):
+    """Everything due before this instant belongs to the current bucket."""
+    return now + timedelta(seconds=settings.NOTIFICATION_BUCKET_SECONDS)
+
+
+def claim_due_notifications(due_before, stale_before, now, limit, ids=None):
+    """
+    Atomically claim up to `limit` due notifications and return their
+    (id, scheduled_time) pairs.
+
+    Rows claimed by an overlapping tick are skipped (skip_locked) or already
+    carry a fresh dispatched_at; claims older than stale_before are assumed
+    lost and taken over. Pass `ids` to only consider those notifications.
+    """
+    due = Notification.objects.due(due_before).filter(
+        Q(dispatched_at__isnull=True) | Q(dispatched_at__lt=stale_before)
+    )
+    if ids is not None:
+        due = due.filter(id__in=ids)
+
+    with transaction.atomic():
+        claimed = list(
+            due.select_for_update(skip_locked=True).values_list('id', 'scheduled_time')[:limit]
+        )
+        if claimed:
+            Notification.objects.filter(id__in=[pk for pk, _ in claimed]).update(dispatched_at=now)
+    return claimed
+
+
+def enqueue(claimed, now):
+    # Imported here because tasks.py imports this module
+    from .tasks import send_push_notification
+
+    # One group publish per batch; early ones go now, the rest at their due time
+    group(
+        send_push_notification.signature((notification_id,), eta=max(scheduled_time, now))
+        for notification_id, scheduled_time in claimed
+    ).apply_async()
+
+
+def dispatch_due(now=None, ids=None):
+    """
+    Claim and enqueue everything due before the end of the current bucket, in
+    batches of NOTIFICATION_SCAN_BATCH_SIZE, or only `ids`, all in one batch.
+    Returns how many were dispatched.
+    """
+    now = now or timezone.now()
+    due_before = bucket_end(now)
+    stale_before = now - timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT)
+    # A known id list (a bulk scheduling request) is claimed and published
+    # as one group; the open-ended scan goes in bounded batches
+    batch_size = max(len(ids), 1) if ids is not None else settings.NOTIFICATION_SCAN_BATCH_SIZE
+
+    dispatched = 0
+    while True:
+        claimed = claim_due_notifications(due_before, stale_before, now, batch_size, ids=ids)
+        if claimed:
+            enqueue(claimed, now)
+            dispatched += len(claimed)
+        if len(claimed) < batch_size:
+            return dispatched
+
+
+def schedule_notifications(notifications):
+    """
+    Make newly created or rescheduled notifications deliverable.
+
+    Most need nothing: the dispatcher finds them when their bucket comes up.
+    Only ones due inside the bucket already being worked on are dispatched
+    straight away, since the tick that covered it has passed.
+    """
+    now = timezone.now()
+    soon = [n.id for n in notifications if n.scheduled_time < bucket_end(now)]
+    if not soon:
+        return 0
+    return dispatch_due(now, ids=soon)
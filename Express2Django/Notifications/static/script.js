@@ -31,6 +31,85 @@ window.sendMessageToSW = function(message) {
   });
 };
 
+// Remote logging for debugging devices without a console (iOS home-screen apps).
+// Records are queued and posted to /api/remote-log in batches: when 20 are
+// waiting, every 5 seconds, and with sendBeacon when the page is hidden.
+window.remoteLogQueue = [];
+window.remoteLogBatchSize = 20;
+window.remoteLogInterval = 5000;
+let remoteLogTimer = null;
+
+window.remoteLog = function(message, data = null, level = 'log') {
+  window.remoteLogQueue.push({
+    timestamp: new Date().toISOString(),
+    userAgent: navigator.userAgent,
+    level: level,
+    message: String(message),
+    data: data
+  });
+  // Never let a stuck server grow the queue without bound
+  if (window.remoteLogQueue.length > 500) {
+    window.remoteLogQueue.splice(0, window.remoteLogQueue.length - 500);
+  }
+  if (window.remoteLogQueue.length >= window.remoteLogBatchSize) {
+    flushRemoteLog();
+  } else if (!remoteLogTimer) {
+    remoteLogTimer = setTimeout(flushRemoteLog, window.remoteLogInterval);
+  }
+};
+
+function flushRemoteLog(useBeacon = false) {
+  clearTimeout(remoteLogTimer);
+  remoteLogTimer = null;
+  if (window.remoteLogQueue.length === 0) {
+    return;
+  }
+  const batch = window.remoteLogQueue.splice(0, 200);
+  const body = JSON.stringify(batch);
+
+  if (useBeacon && navigator.sendBeacon) {
+    navigator.sendBeacon('/api/remote-log', new Blob([body], { type: 'application/json' }));
+    return;
+  }
+  fetch('/api/remote-log', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: body,
+    keepalive: true
+  })
+  .then(response => {
+    if (response.status === 429) {
+      // Server buffer is full; the overflow was dropped, so just slow down
+      const retryAfter = parseInt(response.headers.get('Retry-After') || '5') * 1000;
+      remoteLogTimer = setTimeout(flushRemoteLog, retryAfter);
+    }
+  })
+  .catch(() => {
+    // Debug logging is best effort; don't log about failing to log
+  });
+}
+
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden') {
+    flushRemoteLog(true);
+  }
+});
+
+// Opt in with ?remotelog=1 (remembered in localStorage) to mirror console
+// warnings and errors to the server
+if (new URLSearchParams(location.search).get('remotelog') === '1') {
+  localStorage.setItem('remoteLog', '1');
+}
+if (localStorage.getItem('remoteLog') === '1') {
+  ['warn', 'error'].forEach(level => {
+    const original = console[level].bind(console);
+    console[level] = function(...args) {
+      original(...args);
+      window.remoteLog(args.map(arg => arg instanceof Error ? arg.message : String(arg)).join(' '), null, level);
+    };
+  });
+}
+
 // Add sendNotification function
 window.sendNotification = function(title = 'PWA Notification', body = 'This is a notification from your PWA') {
   const statusElement = document.getElementById('status');
@@ -1,5 +1,8 @@
 // Service Worker with Background Sync for PWA Notifications
 const CACHE_NAME = 'notification-pwa-v7';
+// Delta-sync state (cursor + local copy), kept across worker restarts
+const SYNC_CACHE = 'notification-sync';
+const SYNC_STATE_KEY = '/__notification-sync-state';
 const urlsToCache = [
   '/',
   '/static/manifest.json',
@@ -35,7 +38,7 @@ self.addEventListener('activate', event => {
     caches.keys().then(cacheNames => {
       return Promise.all(
         cacheNames.map(cacheName => {
-          if (cacheName !== CACHE_NAME) {
+          if (cacheName !== CACHE_NAME && cacheName !== SYNC_CACHE) {
             console.log('Deleting old cache:', cacheName);
             return caches.delete(cacheName);
           }
@@ -92,6 +95,91 @@ self.addEventListener('periodicsync', event => {
   }
 });
 
+async function loadSyncState() {
+  try {
+    const cache = await caches.open(SYNC_CACHE);
+    const response = await cache.match(SYNC_STATE_KEY);
+    if (response) {
+      return await response.json();
+    }
+  } catch (error) {
+    console.warn('Could not read sync state:', error);
+  }
+  return { cursor: null, notifications: {} };
+}
+
+async function saveSyncState(state) {
+  const cache = await caches.open(SYNC_CACHE);
+  await cache.put(SYNC_STATE_KEY, new Response(JSON.stringify(state), {
+    headers: { 'Content-Type': 'application/json' }
+  }));
+}
+
+// Bring the local copy of the user's scheduled notifications up to date,
+// fetching only what changed since the last sync
+async function fetchScheduledNotifications() {
+  const state = await loadSyncState();
+  let more;
+  do {
+    let url = '/api/notifications/changes?fields=id,title,body,scheduled_time,repeat';
+    if (state.cursor) {
+      url += '&since=' + encodeURIComponent(state.cursor);
+    }
+    const response = await fetch(url, { cache: 'no-store' });
+    if (!response.ok) {
+      throw new Error('Failed to fetch notification changes: ' + response.status);
+    }
+    const delta = await response.json();
+    if (delta.reset) {
+      state.notifications = {};
+    }
+    for (const notification of delta.changes) {
+      state.notifications[notification.id] = notification;
+    }
+    for (const id of delta.removed) {
+      delete state.notifications[id];
+    }
+    state.cursor = delta.cursor;
+    more = delta.more;
+  } while (more);
+  await saveSyncState(state);
+  return Object.values(state.notifications);
+}
+
+// Ids of shown one-time notifications not yet deleted on the server. Kept
+// until a flush succeeds, so a catch-up sync after being offline sends one
+// request instead of one per notification.
+const pendingAcks = new Set();
+const MAX_ACK_BATCH = 1000;
+
+async function flushAcknowledgements() {
+  while (pendingAcks.size > 0) {
+    const ids = Array.from(pendingAcks).slice(0, MAX_ACK_BATCH);
+    console.log('Deleting one-time notifications:', ids);
+    try {
+      const response = await fetch('/api/notifications/ack', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ ids: ids, action: 'delete' })
+      });
+      // A 4xx other than 429 would fail the same way again, so give up on it
+      if (!response.ok && (response.status >= 500 || response.status === 429)) {
+        throw new Error('Acknowledge failed: ' + response.status);
+      }
+    } catch (error) {
+      console.error('Error deleting notifications, will retry:', error);
+      return;
+    }
+    // Ids the server did not know are gone too, so drop them all locally
+    const state = await loadSyncState();
+    for (const id of ids) {
+      pendingAcks.delete(id);
+      delete state.notifications[id];
+    }
+    await saveSyncState(state);
+  }
+}
+
 // Check for scheduled notifications
 async function checkScheduledNotifications() {
   try {
@@ -100,16 +188,8 @@ async function checkScheduledNotifications() {
     // First try to get notifications from the server
     let notifications = [];
     try {
-      const response = await fetch('/api/get-scheduled-notifications', {
-        cache: 'no-store' // Ensure fresh data
-      });
-      
-      if (response.ok) {
-        notifications = await response.json();
-        console.log('Retrieved scheduled notifications from server:', notifications);
-      } else {
-        console.warn('Failed to fetch scheduled notifications from server, using cached ones');
-      }
+      notifications = await fetchScheduledNotifications();
+      console.log('Retrieved scheduled notifications from server:', notifications);
     } catch (error) {
       console.warn('Error fetching from server, using cached notifications:', error);
     }
@@ -124,9 +204,9 @@ async function checkScheduledNotifications() {
     const now = Date.now();
     for (const notification of notifications) {
       // Check if notification is due to be shown (using either scheduledTime from server or time from cache)
-      const notificationTime = notification.scheduledTime || notification.time;
+      const notificationTime = notification.scheduled_time || notification.scheduledTime || notification.time;
       
-      if (notificationTime <= now && !notification.processed) {
+      if (notificationTime <= now && !notification.processed && !pendingAcks.has(notification.id)) {
         console.log('Showing notification:', notification.title);
         
         await self.registration.showNotification(notification.title, {
@@ -142,17 +222,9 @@ async function checkScheduledNotifications() {
           }
         });
         
-        // For one-time notifications, delete from server
-        if (notification.repeat === 'none') {
-          const idToDelete = notification.id || notification.client_id;
-          console.log('Deleting one-time notification:', notification.id);
-          try {
-            await fetch(`/api/delete-notification/${idToDelete}`, {
-              method: 'DELETE'
-            });
-          } catch (error) {
-            console.error('Error deleting notification:', error);
-          }
+        // One-time notifications are deleted from the server in one batch below
+        if (notification.repeat === 'none' && Number.isInteger(notification.id)) {
+          pendingAcks.add(notification.id);
         }
         
         // Mark as processed in our local cache
@@ -163,6 +235,8 @@ async function checkScheduledNotifications() {
       }
     }
     
+    await flushAcknowledgements();
+    
     return true;
   } catch (error) {
     console.error('Error checking scheduled notifications:', error);
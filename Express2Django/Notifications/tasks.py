@@ -1,133 +1,399 @@
 # In Notifications/tasks.py
-from celery import shared_task
-from datetime import timedelta
+from celery import chord, shared_task
 import json
+import logging
+import random
 import time  # Add this import for the test notification function
-from pywebpush import webpush, WebPushException
+from datetime import timedelta
 from django.conf import settings
+from django.db.models import F
 from django.utils import timezone
-from .models import Notification, PushSubscription
+from django.utils.dateparse import parse_datetime
+from .models import Delivery, Notification, NotificationTombstone, PushSubscription
+from .connections import pool_stats
+from .delivery import deliver, push
+from .ledger import claim_deliveries, prune_ledger, record_outcomes, release_claim
+from .metrics import NOTIFICATIONS_DISPATCHED, NOTIFICATIONS_SENT, PUSH_CHUNK_SECONDS, observe_lateness
+from .recurrence import is_recurring, next_occurrence
+from .scheduler import bucket_end, dispatch_due, schedule_notifications
+from .timing import StageTimer
+from .topics import members
+from .versioning import bump_notification_versions
+
+logger = logging.getLogger(__name__)
 
 @shared_task
 def send_push_notification(notification_id):
+    timer = StageTimer()
+    claimed = False
     try:
-        notification = Notification.objects.get(id=notification_id)
-        print(f"Sending notification {notification_id}: {notification.title}")
-        
-        # Mark as sent
-        notification.sent = True
-        notification.save()
-        
-        # If this is a recurring notification, schedule the next occurrence
-        if notification.repeat != 'none':
-            if notification.repeat == 'daily':
-                next_time = notification.scheduled_time + timedelta(days=1)
-            elif notification.repeat == 'weekly':
-                next_time = notification.scheduled_time + timedelta(weeks=1)
-                
-            # Create a new notification for the next occurrence
-            new_notification = Notification.objects.create(
-                user=notification.user,
-                title=notification.title,
-                body=notification.body,
-                scheduled_time=next_time,
-                repeat=notification.repeat
-            )
-            
-            # Schedule the next push notification
-            schedule_notification_task(new_notification.id, next_time)
-        
-        # Get all subscriptions for this user
-        if notification.user:
-            subscriptions = PushSubscription.objects.filter(user=notification.user)
-        else:
-            subscriptions = PushSubscription.objects.filter(user=None)
-            
-        # Send push notification to all subscriptions
-        for subscription in subscriptions:
-            try:
-                subscription_data = subscription.subscription_json
-                print(f"Sending to subscription: {subscription.id}")
-                
-                payload = json.dumps({
-                    "title": notification.title,
-                    "body": notification.body,
-                    "data": {
-                        "notificationId": notification.id
-                    }
-                })
-                
-                # VAPID keys should be configured in your settings
-                vapid_claims = {
-                    "sub": f"mailto:{settings.VAPID_ADMIN_EMAIL}"
+        with timer.stage('db_fetch'):
+            notification = Notification.objects.get(id=notification_id)
+            claimed = claim_occurrence(notification)
+        if not claimed:
+            logger.info("Notification already sent, skipping", extra={'notification_id': notification_id})
+            return {"skipped": True}
+        # scheduled_time is still the occurrence just claimed, even for recurring rules
+        occurrence = notification.scheduled_time.isoformat()
+        NOTIFICATIONS_SENT.inc()
+        observe_lateness(notification.scheduled_time)
+
+        with timer.stage('payload_build'):
+            payload = json.dumps({
+                "title": notification.title,
+                "body": notification.body,
+                "data": {
+                    "notificationId": notification.id
                 }
-                
-                # Send the push notification
-                webpush(
-                    subscription_info=subscription_data,
-                    data=payload,
-                    vapid_private_key=settings.VAPID_PRIVATE_KEY,
-                    vapid_claims=vapid_claims
-                )
-                print(f"Successfully sent to subscription {subscription.id}")
-            except WebPushException as e:
-                print(f"WebPush failed for subscription {subscription.id}: {e}")
-                print(f"Response status: {e.response.status_code if e.response else 'No response'}")
-                print(f"Response body: {e.response.text if e.response else 'No response'}")
-                # If subscription is expired or invalid, remove it
-                if e.response and e.response.status_code in [404, 410]:
-                    subscription.delete()
-            except Exception as e:
-                print(f"Failed to send to subscription {subscription.id}: {str(e)}")
-                
+            })
+
+        # Split the audience into ID ranges so big broadcasts fan out across workers
+        with timer.stage('db_fetch'):
+            ranges = list(subscription_id_ranges(audience_for(notification), settings.PUSH_CHUNK_SIZE))
+        # Chunks carry everything they need, so they still finish if the row
+        # is deleted (acknowledged by a client) while the fan-out is running
+        audience = [notification.user_id, notification.topic_id]
+        if len(ranges) <= 1:
+            # Small audience - not worth the chord overhead
+            return send_push_chunk(notification.id, payload, None, None, timer.seconds, occurrence, audience)
+
+        chord(
+            send_push_chunk.s(notification.id, payload, start_id, end_id, None, occurrence, audience)
+            for start_id, end_id in ranges
+        )(summarize_push_results.s(notification.id))
+        logger.info("Notification fanned out", extra={
+            'notification_id': notification_id, 'chunks': len(ranges), 'stages_ms': timer.as_ms(),
+        })
+        return {"chunks": len(ranges)}
+
     except Notification.DoesNotExist:
-        print(f"Notification {notification_id} not found")
-    except Exception as e:
-        print(f"Error sending push notification: {str(e)}")
+        logger.warning("Notification not found", extra={'notification_id': notification_id})
+    except Exception:
+        logger.exception("Error sending push notification", extra={'notification_id': notification_id})
+        if claimed:
+            # Let the scanner dispatch the occurrence again; the ledger keeps
+            # anything that did go out from being sent twice
+            release_occurrence(notification)
+        raise
+
+def claim_occurrence(notification):
+    """
+    Claim the occurrence at notification.scheduled_time for sending. Only one
+    of the tasks racing for it (ETA task, scanner, redelivery) gets True.
+    """
+    now = timezone.now()
+    if not is_recurring(notification):
+        # One-time: flip sent, conditionally
+        claimed = Notification.objects.filter(id=notification.id, sent=False).update(sent=True, updated_at=now)
+        if claimed:
+            bump_notification_versions([notification.user_id])
+        return bool(claimed)
+
+    # A stale duplicate task reads the already-advanced cursor; don't fire early
+    if notification.scheduled_time > bucket_end(now):
+        return False
+
+    # Recurring: advance the cursor in place (compare-and-swap on its old value)
+    next_time = next_occurrence(notification, now)
+    claimed = Notification.objects.filter(
+        id=notification.id, sent=False, scheduled_time=notification.scheduled_time
+    ).update(scheduled_time=next_time, dispatched_at=None, last_sent_at=now, updated_at=now)
+    if claimed:
+        bump_notification_versions([notification.user_id])
+    return bool(claimed)
+
+def release_occurrence(notification):
+    """
+    Undo claim_occurrence for a send that failed before its chunks were
+    queued: the occurrence at notification.scheduled_time is due again.
+    """
+    now = timezone.now()
+    if not is_recurring(notification):
+        released = Notification.objects.filter(id=notification.id, sent=True).update(
+            sent=False, dispatched_at=None, updated_at=now
+        )
+    else:
+        # claim_occurrence moved the cursor past this occurrence; move it back
+        released = Notification.objects.filter(
+            id=notification.id, sent=False, scheduled_time__gt=notification.scheduled_time,
+        ).update(scheduled_time=notification.scheduled_time, dispatched_at=None, updated_at=now)
+    if released:
+        bump_notification_versions([notification.user_id])
+    return bool(released)
+
+def audience_for(notification):
+    return audience_subscriptions(notification.user_id, notification.topic_id)
+
+def audience_subscriptions(user_id, topic_id):
+    # A topic's members, all subscriptions for this user, or every anonymous one
+    if topic_id:
+        subscriptions = members(topic_id)
+    elif user_id:
+        subscriptions = PushSubscription.objects.filter(user_id=user_id)
+    else:
+        subscriptions = PushSubscription.objects.filter(user=None)
+    # Skip endpoints that keep failing; a fresh save_subscription resets them
+    return subscriptions.filter(failed_attempts__lt=settings.PUSH_MAX_FAILED_ATTEMPTS)
+
+def subscription_id_ranges(subscriptions, chunk_size):
+    """
+    Yield (start_id, end_id) ranges of roughly chunk_size subscriptions each.
+
+    end_id is exclusive and None for the last range. Each boundary is found with
+    a single indexed lookup, so the audience is never loaded into memory.
+    """
+    ids = subscriptions.order_by('id').values_list('id', flat=True)
+    start_id = ids.first()
+    while start_id is not None:
+        end_id = next(iter(ids.filter(id__gte=start_id)[chunk_size:chunk_size + 1]), None)
+        yield start_id, end_id
+        start_id = end_id
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def send_push_chunk(notification_id, payload, start_id, end_id, stage_seconds=None, occurrence=None, audience=None):
+    # acks_late means a chunk lost with its worker is redelivered, not dropped;
+    # the ledger then limits the redelivery to what wasn't sent yet
+    started = time.perf_counter()
+    timer = StageTimer()
+    # Stages already timed by send_push_notification when it runs us inline
+    for name, seconds in (stage_seconds or {}).items():
+        timer.add(name, seconds)
+
+    with timer.stage('db_fetch'):
+        if audience is not None and occurrence:
+            user_id, topic_id = audience
+            occurrence_time = parse_datetime(occurrence)
+        else:
+            # Queued before chunks carried their audience; needs the row
+            try:
+                notification = Notification.objects.get(id=notification_id)
+            except Notification.DoesNotExist:
+                logger.warning("Notification deleted before its chunk ran", extra={'notification_id': notification_id})
+                return {"sent": 0, "failed": 0, "expired": 0, "retrying": 0, "skipped": 0}
+            user_id, topic_id = notification.user_id, notification.topic_id
+            occurrence_time = occurrence_of(notification, occurrence)
+        subscriptions = audience_subscriptions(user_id, topic_id).order_by('id')
+        if start_id is not None:
+            subscriptions = subscriptions.filter(id__gte=start_id)
+        if end_id is not None:
+            subscriptions = subscriptions.filter(id__lt=end_id)
+        subscription_ids = list(subscriptions.values_list('id', flat=True))
+
+    counts = deliver_batch(
+        notification_id, occurrence_time, payload, subscription_ids, [Delivery.PENDING], 0, timer,
+    )
+    wall = time.perf_counter() - started
+    PUSH_CHUNK_SECONDS.observe(wall)
+    logger.info("Push chunk delivered", extra={
+        'notification_id': notification_id,
+        'start_id': start_id,
+        'end_id': end_id,
+        'subscriptions': len(subscription_ids),
+        **counts,
+        'wall_ms': round(wall * 1000, 2),
+        'stages_ms': timer.as_ms(),
+        'pools': pool_stats(),
+    })
+    return counts
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def retry_push(notification_id, payload, subscription_ids, attempt, occurrence=None):
+    # Ledger rows waiting to retry (or left "sending" by a lost task), all for one push service
+    started = time.perf_counter()
+    timer = StageTimer()
+    if occurrence is None:
+        # Queued before the ledger existed
+        try:
+            occurrence_time = occurrence_of(Notification.objects.get(id=notification_id), None)
+        except Notification.DoesNotExist:
+            logger.warning("Notification deleted before its retry ran", extra={'notification_id': notification_id})
+            return {"sent": 0, "failed": 0, "expired": 0, "retrying": 0, "skipped": len(subscription_ids)}
+    else:
+        occurrence_time = parse_datetime(occurrence)
+    counts = deliver_batch(
+        notification_id, occurrence_time, payload, subscription_ids, [Delivery.RETRYING], attempt, timer,
+    )
+    logger.info("Push retry delivered", extra={
+        'notification_id': notification_id,
+        'attempt': attempt,
+        'subscriptions': len(subscription_ids),
+        **counts,
+        'wall_ms': round((time.perf_counter() - started) * 1000, 2),
+        'stages_ms': timer.as_ms(),
+    })
+    return counts
+
+def occurrence_of(notification, occurrence):
+    """
+    The firing a chunk belongs to, as passed by send_push_notification.
+    Messages queued before the ledger don't carry it: a one-time notification
+    only has the one, a recurring rule's cursor has moved on by then.
+    """
+    if occurrence:
+        return parse_datetime(occurrence)
+    if is_recurring(notification) and notification.last_sent_at:
+        return notification.last_sent_at
+    return notification.scheduled_time
+
+def deliver_batch(notification_id, occurrence, payload, subscription_ids, statuses, attempt, timer):
+    """
+    Claim these subscriptions' ledger rows, push to the ones claimed and write
+    the outcomes back. Returns sent/failed/expired/retrying/skipped counts.
+    """
+    with timer.stage('db_fetch'):
+        claim, claimed, in_flight = claim_deliveries(notification_id, occurrence, subscription_ids, statuses)
+    if in_flight and attempt < settings.PUSH_MAX_RETRIES:
+        # Another task holds these; look again once its claim could have gone stale
+        retry_push.apply_async(
+            (notification_id, payload, in_flight, attempt + 1, occurrence.isoformat()),
+            countdown=settings.PUSH_DELIVERY_CLAIM_TIMEOUT,
+        )
+
+    try:
+        subscriptions = PushSubscription.objects.filter(id__in=claimed).order_by('id')
+        rows = timer.timed_iter(subscriptions.iterator(chunk_size=settings.PUSH_CHUNK_SIZE), 'db_fetch')
+        results = deliver(rows, payload, timer=timer)
+
+        with timer.stage('write_back'):
+            # Transient failures get another go; only final outcomes count against the subscription
+            retries = plan_retries(results, attempt)
+            retrying_ids = {result.subscription_id for group in retries.values() for result in group}
+            record_outcomes(claim, results, retrying_ids)
+            counts = record_delivery_results(r for r in results if r.subscription_id not in retrying_ids)
+    except Exception:
+        # acks_late only covers a dead worker; a raising task must hand its
+        # claim back itself or those rows sit in "sending" with nobody coming
+        release_failed_claim(notification_id, occurrence, payload, claim, attempt)
+        raise
+    # Only once the ledger says "retrying", or the retry would find nothing to claim
+    schedule_retries(notification_id, occurrence, payload, retries, attempt)
+    counts["retrying"] = len(retrying_ids)
+    counts["skipped"] = len(subscription_ids) - len(claimed)
+    return counts
+
+def release_failed_claim(notification_id, occurrence, payload, claim, attempt):
+    # Unrecorded rows go back to "retrying" with a retry queued, or to
+    # "failed" once out of attempts. Some may have been sent before the
+    # failure; resending those beats losing the rest.
+    if attempt >= settings.PUSH_MAX_RETRIES:
+        abandoned = release_claim(claim, Delivery.FAILED)
+        logger.error("Gave up on push after task failures", extra={
+            'notification_id': notification_id, 'subscriptions': len(abandoned),
+        })
+        return
+    released = release_claim(claim, Delivery.RETRYING)
+    if released:
+        retry_push.apply_async(
+            (notification_id, payload, released, attempt + 1, occurrence.isoformat()),
+            countdown=retry_delay(attempt),
+        )
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Exponential backoff with jitter (between half and all of the doubled
+    delay, so retries from many chunks spread out), never sooner than the
+    push service's Retry-After.
+    """
+    ceiling = min(settings.PUSH_RETRY_BASE_DELAY * 2 ** attempt, settings.PUSH_RETRY_MAX_DELAY)
+    return max(random.uniform(ceiling / 2, ceiling), retry_after or 0)
+
+def plan_retries(results, attempt):
+    """
+    The transient failures in results that get another attempt, grouped by
+    push service so a long Retry-After from one doesn't hold up the others.
+    """
+    if attempt >= settings.PUSH_MAX_RETRIES:
+        return {}
+    by_origin = {}
+    for result in results:
+        if result.retryable:
+            by_origin.setdefault(result.origin, []).append(result)
+    return by_origin
+
+def schedule_retries(notification_id, occurrence, payload, retries, attempt):
+    # One retry task per push service, backed off from the latest Retry-After
+    for origin_results in retries.values():
+        retry_after = max(result.retry_after or 0 for result in origin_results)
+        retry_push.apply_async(
+            (
+                notification_id, payload, [result.subscription_id for result in origin_results],
+                attempt + 1, occurrence.isoformat(),
+            ),
+            countdown=retry_delay(attempt, retry_after),
+        )
+
+def record_delivery_results(results):
+    """
+    Write a batch of delivery results back in a handful of queries: one
+    UPDATE for successes, one for failures and one DELETE for dead endpoints.
+    """
+    sent, failed, expired = [], [], []
+    for result in results:
+        if result.ok:
+            sent.append(result.subscription_id)
+        elif result.expired:
+            # Subscription is expired or invalid - remove it
+            expired.append(result.subscription_id)
+        else:
+            failed.append(result.subscription_id)
+
+    if sent:
+        PushSubscription.objects.filter(id__in=sent).update(
+            last_successful_push=timezone.now(), failed_attempts=0
+        )
+    if failed:
+        PushSubscription.objects.filter(id__in=failed).update(failed_attempts=F('failed_attempts') + 1)
+    if expired:
+        PushSubscription.objects.filter(id__in=expired).delete()
+
+    return {"sent": len(sent), "failed": len(failed), "expired": len(expired)}
+
+@shared_task
+def summarize_push_results(chunk_results, notification_id):
+    # Chord callback - add up the counts reported by every chunk
+    totals = {"sent": 0, "failed": 0, "expired": 0, "retrying": 0, "skipped": 0}
+    for counts in chunk_results:
+        for key in totals:
+            totals[key] += counts.get(key, 0)
+    totals["chunks"] = len(chunk_results)
+    logger.info("Notification fan-out complete", extra={'notification_id': notification_id, **totals})
+    return totals
 
 @shared_task
 def schedule_notification_task(notification_id, scheduled_time=None):
+    # Kept for callers and queued messages from before the bucketed scheduler;
+    # scheduled_time is ignored, the row's own scheduled_time is what counts
     try:
         notification = Notification.objects.get(id=notification_id)
-        
-        # If time is provided, use it; otherwise use the notification's scheduled time
-        if scheduled_time is None:
-            scheduled_time = notification.scheduled_time
-        
-        # Schedule the task at the appropriate time
-        send_push_notification.apply_async(
-            args=[notification_id],
-            eta=scheduled_time
-        )
-        
-        return f"Scheduled notification {notification_id} for {scheduled_time}"
+        dispatched = schedule_notifications([notification])
+        return f"Scheduled notification {notification_id} for {notification.scheduled_time} (dispatched now: {bool(dispatched)})"
     except Exception as e:
         return f"Failed to schedule notification: {str(e)}"
 
 @shared_task
 def check_pending_notifications():
-    print("Running check_pending_notifications")
-    now = timezone.now()
-    print(f"Current time: {now}")
-
-    # Get ALL notifications and print their details
-    all_notifications = Notification.objects.all()
-    print(f"All notifications in database:")
-    for n in all_notifications:
-        print(f"ID: {n.id}, Title: {n.title}, Time: {n.scheduled_time}, Sent: {n.sent}")
-
-    # Get due notifications
-    due_notifications = Notification.objects.filter(
-        scheduled_time__lte=now,
-        sent=False
-    )
-    print(f"Due notifications: {[{'id': n.id, 'title': n.title, 'time': n.scheduled_time} for n in due_notifications]}")
-    
-    for notification in due_notifications:
-        print(f"Processing notification {notification.id}")
-        send_push_notification.delay(notification.id)
-    
-    return f"Checked for pending notifications. Found {due_notifications.count()}"
+    # Beat tick: pop the next bucket of due notifications
+    dispatched = dispatch_due()
+    NOTIFICATIONS_DISPATCHED.inc(dispatched)
+    if dispatched:
+        logger.info("Dispatched due notifications", extra={'dispatched': dispatched})
+    return f"Checked for pending notifications. Dispatched {dispatched}"
+
+@shared_task
+def prune_deliveries():
+    # Daily: settled ledger rows are only needed while a retry could still come
+    cutoff = timezone.now() - timedelta(days=settings.PUSH_LEDGER_RETENTION_DAYS)
+    deleted = prune_ledger(cutoff)
+    if deleted:
+        logger.info("Pruned delivery ledger", extra={'deleted': deleted})
+    return deleted
+
+@shared_task
+def prune_tombstones():
+    # Daily: clients with older cursors are sent a full resync instead
+    cutoff = timezone.now() - timedelta(days=settings.NOTIFICATION_TOMBSTONE_RETENTION_DAYS)
+    deleted, _ = NotificationTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
 
 @shared_task
 def send_test_push_notification(subscription):
@@ -142,18 +408,8 @@ def send_test_push_notification(subscription):
             }
         })
         
-        # VAPID keys should be configured in your settings
-        vapid_claims = {
-            "sub": f"mailto:{settings.VAPID_ADMIN_EMAIL}"
-        }
-        
-        # Send the push notification with proper error handling
-        webpush(
-            subscription_info=subscription,
-            data=payload,
-            vapid_private_key=settings.VAPID_PRIVATE_KEY,
-            vapid_claims=vapid_claims
-        )
+        # Send the push notification with cached VAPID headers
+        push(subscription, payload)
         return True
-    except Exception as e:
-        print(f"Error sending test notification: {e}")
+    except Exception:
+        logger.exception("Error sending test notification")
@@ -1,3 +1,588 @@
+import importlib
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
+
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.db.models import ProtectedError
 from django.test import TestCase
+from django.utils import timezone
+from prometheus_client import REGISTRY
+
+from . import connections, encryption, ratelimit, vapid
+from .delivery import DeliveryResult
+from .ledger import claim_deliveries, record_outcomes
+from .metrics import push_service
+from .models import Delivery, Notification, PushSubscription, Topic
+from .ratelimit import MemoryRateLimiter, RedisRateLimiter, parse_retry_after
+from .recurrence import next_occurrence
+from .remotelog import LogBuffer
+from .scheduler import claim_due_notifications, dispatch_due, schedule_notifications
+from .tasks import retry_push, send_push_chunk, send_push_notification
+from .timing import StageTimer
+from .versioning import bump_notification_versions
+
+
+def sent_results(subscriptions):
+    return [DeliveryResult(subscription_id=s.id, origin='https://push.example', status_code=201) for s in subscriptions]
+
+
+class DeliveryLedgerTests(TestCase):
+    def setUp(self):
+        self.subscriptions = [
+            PushSubscription.objects.create(
+                subscription_json={'endpoint': f'https://push.example/{i}', 'keys': {}}
+            )
+            for i in range(5)
+        ]
+        self.notification = Notification.objects.create(
+            title='Hello', body='World', scheduled_time=timezone.now() - timedelta(seconds=1)
+        )
+        self.occurrence = self.notification.scheduled_time
+        self.ids = [s.id for s in self.subscriptions]
+
+    def statuses(self):
+        return set(Delivery.objects.values_list('status', flat=True))
+
+    def test_second_claim_finds_rows_in_flight(self):
+        claim, claimed, in_flight = claim_deliveries(self.notification.id, self.occurrence, self.ids, [Delivery.PENDING])
+        self.assertEqual(sorted(claimed), self.ids)
+        self.assertEqual(in_flight, [])
+
+        _, claimed, in_flight = claim_deliveries(self.notification.id, self.occurrence, self.ids, [Delivery.PENDING])
+        self.assertEqual(claimed, [])
+        self.assertEqual(sorted(in_flight), self.ids)
+
+    def test_stale_claim_is_taken_over(self):
+        claim_deliveries(self.notification.id, self.occurrence, self.ids, [Delivery.PENDING])
+        Delivery.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+
+        _, claimed, _ = claim_deliveries(self.notification.id, self.occurrence, self.ids, [Delivery.PENDING])
+        self.assertEqual(sorted(claimed), self.ids)
+        self.assertEqual(set(Delivery.objects.values_list('attempt', flat=True)), {2})
+
+    def test_redelivered_chunk_only_sends_the_remainder(self):
+        # First delivery got through two subscriptions before its worker died
+        claim, _, _ = claim_deliveries(self.notification.id, self.occurrence, self.ids, [Delivery.PENDING])
+        record_outcomes(claim, sent_results(self.subscriptions[:2]), set())
+        Delivery.objects.filter(status=Delivery.SENDING).update(claimed_at=timezone.now() - timedelta(hours=1))
+
+        with mock.patch('Notifications.tasks.deliver', side_effect=lambda rows, *a, **k: sent_results(list(rows))) as deliver:
+            counts = send_push_chunk(
+                self.notification.id, '{}', None, None, occurrence=self.occurrence.isoformat()
+            )
+        self.assertEqual(counts['sent'], 3)
+        self.assertEqual(counts['skipped'], 2)
+        self.assertEqual(deliver.call_count, 1)
+        self.assertEqual(self.statuses(), {Delivery.SENT})
+
+    def test_failed_send_hands_claim_back_for_retry(self):
+        with mock.patch('Notifications.tasks.deliver', side_effect=RuntimeError('boom')), \
+                mock.patch.object(retry_push, 'apply_async') as apply_async:
+            with self.assertRaises(RuntimeError):
+                send_push_notification(self.notification.id)
+
+        # Nothing left stuck in "sending", and a retry is queued for all of it
+        self.assertEqual(self.statuses(), {Delivery.RETRYING})
+        self.assertFalse(Delivery.objects.exclude(claim=None).exists())
+        apply_async.assert_called_once()
+        notification_id, _, subscription_ids, attempt, occurrence = apply_async.call_args.args[0]
+        self.assertEqual(notification_id, self.notification.id)
+        self.assertEqual(sorted(subscription_ids), self.ids)
+        self.assertEqual(attempt, 1)
+
+        # The occurrence is due again for the scanner
+        self.notification.refresh_from_db()
+        self.assertFalse(self.notification.sent)
+
+        # The queued retry picks the rows up and finishes the job
+        with mock.patch('Notifications.tasks.deliver', side_effect=lambda rows, *a, **k: sent_results(list(rows))):
+            counts = retry_push(notification_id, '{}', subscription_ids, attempt, occurrence)
+        self.assertEqual(counts['sent'], 5)
+        self.assertEqual(self.statuses(), {Delivery.SENT})
+
+    def test_failed_send_out_of_attempts_is_marked_failed(self):
+        claim_deliveries(self.notification.id, self.occurrence, self.ids, [Delivery.PENDING])
+        Delivery.objects.update(status=Delivery.RETRYING, claim=None)
+
+        with self.settings(PUSH_MAX_RETRIES=1), \
+                mock.patch('Notifications.tasks.deliver', side_effect=RuntimeError('boom')), \
+                mock.patch.object(retry_push, 'apply_async') as apply_async:
+            with self.assertRaises(RuntimeError):
+                retry_push(self.notification.id, '{}', self.ids, 1, self.occurrence.isoformat())
+
+        self.assertEqual(self.statuses(), {Delivery.FAILED})
+        apply_async.assert_not_called()
+
+    def test_failed_recurring_send_restores_the_cursor(self):
+        self.notification.repeat = 'daily'
+        self.notification.save()
+
+        with mock.patch('Notifications.tasks.deliver', side_effect=RuntimeError('boom')), \
+                mock.patch.object(retry_push, 'apply_async'):
+            with self.assertRaises(RuntimeError):
+                send_push_notification(self.notification.id)
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.scheduled_time, self.occurrence)
+        self.assertFalse(self.notification.sent)
+
+    def test_chunks_finish_after_the_notification_is_deleted(self):
+        with self.settings(PUSH_CHUNK_SIZE=2), mock.patch('Notifications.tasks.chord') as chord:
+            send_push_notification(self.notification.id)
+        chunks = list(chord.call_args.args[0])
+        self.assertEqual(len(chunks), 3)
+
+        with mock.patch('Notifications.tasks.deliver', side_effect=lambda rows, *a, **k: sent_results(list(rows))):
+            counts = [chunks[0]()]
+            # A client acknowledges (deletes) the broadcast mid fan-out
+            self.notification.delete()
+            counts += [chunk() for chunk in chunks[1:]]
+
+        self.assertEqual(sum(c['sent'] for c in counts), 5)
+        # The ledger outlives the row, so a redelivered chunk still sends nothing twice
+        self.assertEqual(Delivery.objects.filter(status=Delivery.SENT).count(), 5)
+        self.assertEqual(chunks[0]()['skipped'], 2)
+
+
+class BrokenPool:
+    """Stands in for a ProcessPoolExecutor whose children have died."""
+
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+        self.submitted = 0
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        if self.fail_on == 'submit' and self.submitted:
+            raise BrokenProcessPool('A child process terminated abruptly')
+        self.submitted += 1
+        future = Future()
+        if self.fail_on == 'result':
+            future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+        else:
+            future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+class EncryptionPoolTests(TestCase):
+    def setUp(self):
+        self.subscriptions = [SimpleNamespace(id=i, subscription_json={}) for i in range(10)]
+
+    def run_broken_pool(self, fail_on):
+        pool = BrokenPool(fail_on)
+        with self.settings(PUSH_ENCRYPT_PROCESSES=2), \
+                mock.patch.object(encryption, '_pool', pool), mock.patch.object(encryption, '_pool_pid', os.getpid()):
+            out = list(encryption.pre_encrypt(iter(self.subscriptions), b'x', StageTimer(), batch_size=3))
+            # The broken pool is forgotten, so the next fan-out gets a new one
+            self.assertIsNone(encryption._pool)
+        self.assertTrue(pool.shut_down)
+        return out
+
+    def test_broken_pool_on_submit_falls_back_inline(self):
+        out = self.run_broken_pool('submit')
+        self.assertEqual([subscription.id for subscription, _ in out], list(range(10)))
+
+    def test_broken_pool_on_result_falls_back_inline(self):
+        out = self.run_broken_pool('result')
+        self.assertEqual([subscription.id for subscription, _ in out], list(range(10)))
+        self.assertTrue(all(body is None for _, body in out))
+
+
+class TopicBroadcastTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.topic = Topic.objects.create(name='news')
+        self.broadcast = Notification.objects.create(
+            user=self.staff, topic=self.topic, title='News', body='', scheduled_time=timezone.now()
+        )
+        self.own = Notification.objects.create(user=self.staff, title='Mine', body='', scheduled_time=timezone.now())
+        self.client.force_login(self.staff)
+
+    def test_broadcast_is_not_the_creators_notification(self):
+        self.assertEqual(list(Notification.objects.pending_for(self.staff)), [self.own])
+        response = self.client.get('/api/notifications/changes', secure=True)
+        self.assertEqual([n['id'] for n in response.json()['changes']], [self.own.id])
+
+    def test_creator_cannot_acknowledge_or_delete_a_broadcast(self):
+        response = self.client.post(
+            '/api/notifications/ack', json.dumps({'ids': [self.broadcast.id, self.own.id]}),
+            content_type='application/json', secure=True,
+        )
+        self.assertEqual(response.json()['acknowledged'], [self.own.id])
+        response = self.client.delete(f'/api/delete-notification/{self.broadcast.id}', secure=True)
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Notification.objects.filter(id=self.broadcast.id).exists())
+
+    def test_joining_needs_an_existing_topic(self):
+        subscription = PushSubscription.objects.create(subscription_json={'endpoint': 'https://push.example/1'})
+        body = json.dumps({'endpoint': subscription.endpoint})
+        self.client.logout()
+        response = self.client.post('/api/topics/made-up/subscription', body, content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Topic.objects.filter(name='made-up').exists())
+
+        response = self.client.post('/api/topics/news/subscription', body, content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.topic.topicmembership_set.filter(subscription=subscription).exists())
+
+    def test_topic_with_broadcasts_cannot_be_deleted(self):
+        with self.assertRaises(ProtectedError):
+            self.topic.delete()
+
+
+class CursorTests(TestCase):
+    def test_out_of_range_cursor_is_a_bad_request(self):
+        for url in (
+            '/api/get-scheduled-notifications?cursor=100000000000000000000000_1',
+            '/api/notifications/changes?since=1.100000000000000000000000_1',
+            '/api/notifications/changes?since=1.-100000000000000000000000_1',
+        ):
+            self.assertEqual(self.client.get(url, secure=True).status_code, 400, url)
+
+    def test_malformed_cursor_is_a_plain_bad_request(self):
+        for url in (
+            '/api/get-scheduled-notifications?cursor=abc',
+            '/api/get-scheduled-notifications?cursor=1_2_3',
+            '/api/notifications/changes?since=abc',
+            '/api/notifications/changes?since=x.1_1',
+            '/api/notifications/changes?since=1.1_x',
+        ):
+            response = self.client.get(url, secure=True)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertEqual(response.json()['error'], 'Invalid cursor', url)
+
+    def test_etag_differs_between_users(self):
+        etags = []
+        for name in ('a', 'b'):
+            user = User.objects.create_user(name)
+            Notification.objects.create(user=user, title=name, body='', scheduled_time=timezone.now())
+            bump_notification_versions([user.id])
+            self.client.force_login(user)
+            etags.append(self.client.get('/api/get-scheduled-notifications', secure=True)['ETag'])
+        self.assertNotEqual(etags[0], etags[1])
+
+
+class AcknowledgeTests(TestCase):
+    def test_sent_leaves_recurring_rules_running(self):
+        now = timezone.now()
+        once = Notification.objects.create(title='Once', body='', scheduled_time=now)
+        daily = Notification.objects.create(title='Daily', body='', scheduled_time=now, repeat='daily')
+        response = self.client.post(
+            '/api/notifications/ack', json.dumps({'ids': [once.id, daily.id], 'action': 'sent'}),
+            content_type='application/json', secure=True,
+        )
+        self.assertEqual(response.json()['acknowledged'], [once.id])
+        self.assertFalse(Notification.objects.get(id=daily.id).sent)
+
+
+class MetricsTests(TestCase):
+    def test_no_token_hides_metrics_outside_debug(self):
+        with self.settings(METRICS_TOKEN='', DEBUG=False):
+            self.assertEqual(self.client.get('/metrics', secure=True).status_code, 404)
+
+    def test_token_is_required(self):
+        with self.settings(METRICS_TOKEN='s3cret', DEBUG=False):
+            self.assertEqual(self.client.get('/metrics', secure=True).status_code, 401)
+            response = self.client.get('/metrics', secure=True, headers={'Authorization': 'Bearer s3cret'})
+            self.assertEqual(response.status_code, 200)
+
+
+class BulkScheduleTests(TestCase):
+    def post_ndjson(self, lines):
+        return self.client.post(
+            '/api/schedule-notifications', '\n'.join(lines),
+            content_type='application/x-ndjson', secure=True,
+        )
+
+    def test_malformed_ndjson_line_only_fails_that_item(self):
+        due = int(timezone.now().timestamp() * 1000) + 3_600_000
+        good = json.dumps({'title': 'Hi', 'scheduledTime': due})
+        response = self.post_ndjson([good, '{"title": "broken', good])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([('id' in result) for result in results], [True, False, True])
+        self.assertIn('Line 2', results[1]['error'])
+
+    def test_due_items_are_published_as_one_group(self):
+        due = int(timezone.now().timestamp() * 1000)
+        lines = [json.dumps({'title': f'n{i}', 'scheduledTime': due}) for i in range(12)]
+        with self.settings(NOTIFICATION_SCAN_BATCH_SIZE=5), mock.patch('Notifications.scheduler.enqueue') as enqueue:
+            response = self.post_ndjson(lines)
+        self.assertEqual(response.json()['dispatched'], 12)
+        self.assertEqual(enqueue.call_count, 1)
+
+    def test_wrongly_typed_fields_are_per_item_errors(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        items = [
+            {'title': 'x', 'scheduledTime': 1, 'repeat': ['a']},
+            {'title': 'x', 'scheduledTime': 1, 'topic': {'name': 'news'}},
+        ]
+        response = self.client.post(
+            '/api/schedule-notifications', json.dumps(items), content_type='application/json', secure=True,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['failed'], 2)
+
+        response = self.client.post(
+            '/api/schedule-notification', json.dumps(items[0]), content_type='application/json', secure=True,
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class DeadRedis:
+    """A redis client whose scripts time out."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def register_script(self, script):
+        def run(keys, args):
+            self.calls += 1
+            raise TimeoutError('Timeout reading from socket')
+        return run
+
+
+class RateLimiterTests(TestCase):
+    def test_dead_redis_is_skipped_until_the_retry_interval(self):
+        client = DeadRedis()
+        limiter = RedisRateLimiter(client, 0, 1, MemoryRateLimiter(0, 1))
+        for _ in range(10):
+            self.assertEqual(limiter.try_acquire('https://push.example'), 0)
+        limiter.pause('https://push.example', 1)
+        self.assertEqual(client.calls, 1)
+
+        limiter._down_until -= ratelimit.REDIS_RETRY_INTERVAL
+        limiter.try_acquire('https://push.example')
+        self.assertEqual(client.calls, 2)
+
+    def test_retry_after_is_finite_and_capped(self):
+        with self.settings(PUSH_RETRY_MAX_DELAY=300):
+            self.assertIsNone(parse_retry_after('inf'))
+            self.assertIsNone(parse_retry_after('nan'))
+            self.assertEqual(parse_retry_after('-5'), 0)
+            self.assertEqual(parse_retry_after('30'), 30)
+            self.assertEqual(parse_retry_after('86400'), 300)
+            self.assertEqual(parse_retry_after('Fri, 31 Dec 9999 23:59:59 GMT'), 300)
+
+
+class OriginBoundTests(TestCase):
+    def test_unknown_push_services_share_one_label(self):
+        self.assertEqual(push_service('https://fcm.googleapis.com'), 'fcm')
+        self.assertEqual(push_service('https://updates.push.services.mozilla.com'), 'mozilla')
+        self.assertEqual(push_service('https://web.push.apple.com'), 'apple')
+        self.assertEqual(push_service('https://wns2-by3p.notify.windows.com'), 'wns')
+        self.assertEqual(push_service('https://evil-fcm.googleapis.com.example'), 'other')
+        self.assertEqual(push_service('https://attacker.example'), 'other')
+
+    def test_sessions_are_bounded(self):
+        with mock.patch.object(connections, '_sessions', OrderedDict()), mock.patch.object(connections, 'MAX_SESSIONS', 3):
+            first = connections.session_for('https://0.example')
+            for i in range(1, 5):
+                connections.session_for(f'https://{i}.example')
+            self.assertEqual(list(connections._sessions), [f'https://{i}.example' for i in range(2, 5)])
+            self.assertIsNot(connections.session_for('https://0.example'), first)
+
+    def test_vapid_cache_is_bounded(self):
+        with mock.patch.object(vapid, '_headers', OrderedDict()), mock.patch.object(vapid, 'MAX_CACHED_ORIGINS', 3):
+            for i in range(5):
+                vapid.vapid_headers(f'https://{i}.example')
+            self.assertEqual(list(vapid._headers), [f'https://{i}.example' for i in range(2, 5)])
+
+
+class FailingSink:
+    def write(self, records):
+        raise OSError('disk full')
+
+
+class RemoteLogBufferTests(TestCase):
+    def sample(self, outcome):
+        return REGISTRY.get_sample_value('remote_log_records_total', {'outcome': outcome}) or 0
+
+    def test_every_outcome_is_counted(self):
+        before = {outcome: self.sample(outcome) for outcome in ('accepted', 'dropped', 'flushed', 'failed')}
+        errors = REGISTRY.get_sample_value('remote_log_sink_errors_total') or 0
+        buffer = LogBuffer(FailingSink(), capacity=3, flush_size=100, flush_interval=60)
+        with mock.patch.object(buffer, 'ensure_flusher'):
+            self.assertEqual(buffer.offer(['a', 'b', 'c', 'd']), (3, 1))
+        buffer.flush()
+        buffer.sink = mock.Mock()
+        with mock.patch.object(buffer, 'ensure_flusher'):
+            buffer.offer(['e'])
+        buffer.flush()
+
+        counts = {outcome: self.sample(outcome) - before[outcome] for outcome in before}
+        self.assertEqual(counts, {'accepted': 4, 'dropped': 1, 'flushed': 1, 'failed': 3})
+        self.assertEqual(REGISTRY.get_sample_value('remote_log_sink_errors_total') - errors, 1)
+
+
+class RecurrenceTests(TestCase):
+    def rule(self, scheduled_time, repeat='daily', repeat_interval=1):
+        return Notification(title='Rule', body='', scheduled_time=scheduled_time, repeat=repeat, repeat_interval=repeat_interval)
+
+    def test_next_occurrence_is_one_step_on(self):
+        cursor = timezone.now()
+        self.assertEqual(next_occurrence(self.rule(cursor), cursor), cursor + timedelta(days=1))
+        # Fired early, inside the bucket before its time
+        self.assertEqual(next_occurrence(self.rule(cursor), cursor - timedelta(seconds=30)), cursor + timedelta(days=1))
+        self.assertEqual(next_occurrence(self.rule(cursor, 'weekly', 2), cursor), cursor + timedelta(weeks=2))
+
+    def test_missed_occurrences_are_skipped(self):
+        cursor = timezone.now() - timedelta(days=3, hours=12)
+        now = cursor + timedelta(days=3, hours=12)
+        self.assertEqual(next_occurrence(self.rule(cursor), now), cursor + timedelta(days=4))
+        # Landing exactly on a missed occurrence still moves past it
+        self.assertEqual(next_occurrence(self.rule(cursor), cursor + timedelta(days=2)), cursor + timedelta(days=3))
+        self.assertGreater(next_occurrence(self.rule(cursor, 'weekly', 3), now), now)
+
+
+class CollapseRecurringMigrationTests(TestCase):
+    def collapse(self):
+        migration = importlib.import_module('Notifications.migrations.0010_collapse_recurring_notifications')
+        migration.collapse_chains(django_apps, None)
+
+    def make(self, scheduled_time, sent, title='Standup', repeat='daily', user=None):
+        return Notification.objects.create(
+            user=user, title=title, body='', scheduled_time=scheduled_time, repeat=repeat, sent=sent,
+        )
+
+    def test_chain_keeps_its_unsent_head(self):
+        start = datetime(2026, 1, 1, 8, tzinfo=dt_timezone.utc)
+        fired = [self.make(start + timedelta(days=i), True) for i in range(3)]
+        head = self.make(start + timedelta(days=3), False)
+        self.collapse()
+        self.assertEqual(list(Notification.objects.values_list('id', flat=True)), [head.id])
+        head.refresh_from_db()
+        self.assertEqual(head.last_sent_at, fired[-1].scheduled_time)
+
+    def test_fully_fired_chain_keeps_its_latest_row(self):
+        start = datetime(2026, 1, 1, 8, tzinfo=dt_timezone.utc)
+        fired = [self.make(start + timedelta(days=i), True) for i in range(3)]
+        self.collapse()
+        self.assertEqual(list(Notification.objects.values_list('id', flat=True)), [fired[-1].id])
+
+    def test_chains_are_split_by_owner_text_frequency_and_time_of_day(self):
+        user = User.objects.create_user('owner')
+        morning = datetime(2026, 1, 1, 8, tzinfo=dt_timezone.utc)
+        kept = [
+            self.make(morning, False),
+            self.make(morning + timedelta(hours=12), False),  # 8pm daily, same text
+            self.make(morning, False, user=user),
+            self.make(morning, False, title='Retro'),
+            self.make(morning, False, repeat='weekly'),
+        ]
+        one_off = [self.make(morning - timedelta(days=i), True, repeat='none') for i in range(1, 3)]
+        self.collapse()
+        self.assertEqual(
+            sorted(Notification.objects.values_list('id', flat=True)),
+            sorted(n.id for n in kept + one_off),
+        )
+
+
+class ClaimDueTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.due = [
+            Notification.objects.create(title=f'due {i}', body='', scheduled_time=self.now - timedelta(minutes=i))
+            for i in range(3)
+        ]
+        Notification.objects.create(title='later', body='', scheduled_time=self.now + timedelta(hours=1))
+        Notification.objects.create(title='sent', body='', scheduled_time=self.now, sent=True)
+        self.stale_before = self.now - timedelta(minutes=5)
+
+    def claim(self, limit=10, now=None, **kwargs):
+        return claim_due_notifications(self.now, self.stale_before, now or self.now, limit, **kwargs)
+
+    def test_claims_due_rows_oldest_first_up_to_the_limit(self):
+        claimed = self.claim(limit=2)
+        self.assertEqual([pk for pk, _ in claimed], [self.due[2].id, self.due[1].id])
+        self.assertEqual(Notification.objects.filter(dispatched_at=self.now).count(), 2)
+        self.assertEqual([pk for pk, _ in self.claim()], [self.due[0].id])
+
+    def test_fresh_claims_are_skipped_and_stale_ones_taken_over(self):
+        self.claim()
+        self.assertEqual(self.claim(), [])
+        Notification.objects.filter(id=self.due[0].id).update(dispatched_at=self.now - timedelta(minutes=10))
+        self.assertEqual([pk for pk, _ in self.claim()], [self.due[0].id])
+
+    def test_ids_narrow_the_claim(self):
+        self.assertEqual([pk for pk, _ in self.claim(ids=[self.due[1].id])], [self.due[1].id])
+
+
+class DispatchTests(TestCase):
+    def dispatch(self, fn, *args, **kwargs):
+        # Returns (result, [one list of (notification id, eta) per group published])
+        published = []
+
+        def group(signatures):
+            published.append([(sig.args[0], sig.options['eta']) for sig in signatures])
+            return mock.Mock()
+        with mock.patch('Notifications.scheduler.group', side_effect=group):
+            return fn(*args, **kwargs), published
+
+    def test_scan_dispatches_the_bucket_in_batches(self):
+        now = timezone.now()
+        past = [Notification.objects.create(title=f'p{i}', body='', scheduled_time=now - timedelta(minutes=i)) for i in range(4)]
+        soon = Notification.objects.create(title='soon', body='', scheduled_time=now + timedelta(seconds=30))
+        Notification.objects.create(title='next bucket', body='', scheduled_time=now + timedelta(minutes=5))
+
+        with self.settings(NOTIFICATION_SCAN_BATCH_SIZE=2, NOTIFICATION_BUCKET_SECONDS=60):
+            dispatched, published = self.dispatch(dispatch_due, now)
+            self.assertEqual(dispatched, 5)
+            self.assertEqual([len(batch) for batch in published], [2, 2, 1])
+            etas = dict(item for batch in published for item in batch)
+            # Overdue ones go now, the rest of the bucket at its due time
+            self.assertEqual({etas[n.id] for n in past}, {now})
+            self.assertEqual(etas[soon.id], soon.scheduled_time)
+
+            # The next tick finds everything already claimed
+            self.assertEqual(self.dispatch(dispatch_due, now), (0, []))
+
+    def test_new_notifications_wait_for_their_bucket(self):
+        now = timezone.now()
+        later = Notification.objects.create(title='later', body='', scheduled_time=now + timedelta(hours=2))
+        due = Notification.objects.create(title='due', body='', scheduled_time=now)
+        self.assertEqual(self.dispatch(schedule_notifications, [later]), (0, []))
+        dispatched, published = self.dispatch(schedule_notifications, [later, due])
+        self.assertEqual(dispatched, 1)
+        self.assertEqual([[pk for pk, _ in batch] for batch in published], [[due.id]])
+
+
+class SaveSubscriptionTests(TestCase):
+    def save(self, body):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        return self.client.post('/api/save-subscription', body, content_type='application/json', secure=True)
+
+    def test_same_endpoint_is_updated_in_place(self):
+        endpoint = 'https://fcm.googleapis.com/fcm/send/abc'
+        first = self.save({'endpoint': endpoint, 'keys': {'auth': 'old'}}).json()['id']
+        PushSubscription.objects.filter(id=first).update(failed_attempts=3)
+
+        user = User.objects.create_user('owner')
+        self.client.force_login(user)
+        response = self.save({'endpoint': endpoint, 'keys': {'auth': 'new'}})
+        self.assertEqual(response.json()['id'], first)
+
+        subscription = PushSubscription.objects.get()
+        self.assertEqual(subscription.subscription_json['keys'], {'auth': 'new'})
+        self.assertEqual(subscription.user, user)
+        self.assertEqual(subscription.failed_attempts, 0)
 
-# Create your tests here.
+    def test_malformed_subscriptions_are_rejected(self):
+        for body in (
+            '[1, 2]', '"https://push.example"', 'not json', {}, {'endpoint': 5}, {'endpoint': ''},
+            {'endpoint': 'javascript:alert(1)'}, {'endpoint': 'https://'}, {'endpoint': 'https://push.example/' + 'x' * 2048},
+        ):
+            self.assertEqual(self.save(body).status_code, 400, body)
+        self.assertFalse(PushSubscription.objects.exists())
@@ -0,0 +1,51 @@
+# In Notifications/timing.py
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    Accumulates wall time per named stage ("db_fetch", "http_send", ...).
+    Safe to share between the send threads of one delivery; per-stage totals
+    are then summed across threads rather than elapsed time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds, count=1):
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def merge(self, other):
+        for name, seconds in other.seconds.items():
+            self.add(name, seconds, other.counts[name])
+
+    def timed_iter(self, iterable, name):
+        """Yield from iterable, charging the time spent producing items to `name`."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start, 0)
+                return
+            self.add(name, time.perf_counter() - start, 0)
+            yield item
+
+    def as_ms(self):
+        with self._lock:
+            return {name: round(seconds * 1000, 2) for name, seconds in self.seconds.items()}
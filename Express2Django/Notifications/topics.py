@@ -0,0 +1,48 @@
+# In Notifications/topics.py
+#
+# Topic membership is a plain join table (topic, subscription) whose unique
+# index is also the fan-out order: a broadcast reads one topic's members by
+# ascending subscription id, in ranges, never the whole audience at once.
+# Segments computed elsewhere (marketing lists, cohorts) are loaded with
+# set_members, which only writes the difference.
+from .models import PushSubscription, Topic, TopicMembership
+
+MEMBERSHIP_BATCH_SIZE = 1000
+
+
+def members(topic_id):
+    """The topic's subscriptions, as a queryset to filter and order by id."""
+    return PushSubscription.objects.filter(topicmembership__topic_id=topic_id)
+
+
+def add_members(topic, subscription_ids, batch_size=MEMBERSHIP_BATCH_SIZE):
+    # Existing memberships are left alone by the unique constraint
+    TopicMembership.objects.bulk_create(
+        [TopicMembership(topic=topic, subscription_id=subscription_id) for subscription_id in subscription_ids],
+        ignore_conflicts=True,
+        batch_size=batch_size,
+    )
+
+
+def remove_members(topic, subscription_ids, batch_size=MEMBERSHIP_BATCH_SIZE):
+    subscription_ids = list(subscription_ids)
+    removed = 0
+    for start in range(0, len(subscription_ids), batch_size):
+        removed += TopicMembership.objects.filter(
+            topic=topic, subscription_id__in=subscription_ids[start:start + batch_size]
+        ).delete()[0]
+    return removed
+
+
+def set_members(name, subscription_ids, batch_size=MEMBERSHIP_BATCH_SIZE):
+    """
+    Make the topic called `name` (created if missing) contain exactly these
+    subscriptions. Returns (topic, added, removed).
+    """
+    topic, _ = Topic.objects.get_or_create(name=name)
+    wanted = set(subscription_ids)
+    current = set(TopicMembership.objects.filter(topic=topic).values_list('subscription_id', flat=True).iterator())
+    added = wanted - current
+    add_members(topic, sorted(added), batch_size)
+    removed = remove_members(topic, sorted(current - wanted), batch_size)
+    return topic, len(added), removed
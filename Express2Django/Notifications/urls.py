@@ -10,9 +10,14 @@ urlpatterns = [
     
     # Notification management
     path('api/schedule-notification', views.schedule_notification, name='schedule_notification'),
+    path('api/schedule-notifications', views.schedule_notifications_batch, name='schedule_notifications_batch'),
     path('api/delete-notification/<int:notification_id>', views.delete_notification, name='delete_notification'),
+    path('api/notifications/ack', views.acknowledge_notifications, name='acknowledge_notifications'),
+    path('api/topics/<slug:name>/subscription', views.topic_subscription, name='topic_subscription'),
     path('api/get-scheduled-notifications', views.get_scheduled_notifications, name='get_notifications'),
+    path('api/notifications/changes', views.notification_changes, name='notification_changes'),
     path('api/send-test-notification', views.send_test_notification, name='test_notification'),
     path('api/remote-log', views.remote_log, name='remote_log'),
-    path('service-worker.js', views.service_worker, name='service_worker')
+    path('service-worker.js', views.service_worker, name='service_worker'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
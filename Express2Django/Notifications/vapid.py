@@ -0,0 +1,58 @@
+# In Notifications/vapid.py
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from py_vapid import Vapid
+
+# Same lifetime pywebpush uses; push services reject tokens valid for over 24h
+VAPID_TOKEN_LIFETIME = 12 * 60 * 60
+# Re-sign a little early so a token never expires while a request is in flight
+VAPID_REFRESH_MARGIN = 10 * 60
+# Endpoints come from clients, so origins are not a fixed set; past this many
+# the longest-held token is dropped (a busy origin is re-signed every 12h anyway)
+MAX_CACHED_ORIGINS = 256
+
+_lock = threading.RLock()
+_key = None
+_headers = OrderedDict()  # push-service origin -> (expires_at, headers), oldest signed first
+
+
+def vapid_key():
+    """The VAPID private key, parsed once per process."""
+    global _key
+    if _key is None:
+        with _lock:
+            if _key is None:
+                _key = Vapid.from_string(private_key=settings.VAPID_PRIVATE_KEY)
+    return _key
+
+
+def vapid_headers(origin):
+    """
+    Signed VAPID headers for a push-service origin (the JWT "aud" claim).
+
+    Tokens are reused until they are close to expiry, so a broadcast signs
+    once per push service instead of once per subscription.
+    """
+    now = time.time()
+    cached = _headers.get(origin)
+    if cached and cached[0] - VAPID_REFRESH_MARGIN > now:
+        return cached[1]
+
+    with _lock:
+        cached = _headers.get(origin)
+        if cached and cached[0] - VAPID_REFRESH_MARGIN > now:
+            return cached[1]
+        expires_at = int(now) + VAPID_TOKEN_LIFETIME
+        headers = vapid_key().sign({
+            "aud": origin,
+            "exp": expires_at,
+            "sub": f"mailto:{settings.VAPID_ADMIN_EMAIL}",
+        })
+        _headers.pop(origin, None)
+        _headers[origin] = (expires_at, headers)
+        while len(_headers) > MAX_CACHED_ORIGINS:
+            _headers.popitem(last=False)
+        return headers
@@ -0,0 +1,59 @@
+# In Notifications/versioning.py
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ChangeCounter, NotificationTombstone
+
+ANONYMOUS_SCOPE = 'anonymous'
+
+
+def scope_for(user_id):
+    return f"user:{user_id}" if user_id else ANONYMOUS_SCOPE
+
+
+def bump_notification_versions(user_ids):
+    """
+    Record that the pending notifications of these users (None for the
+    anonymous audience) changed. Two queries however many users are given.
+    """
+    scopes = {scope_for(user_id) for user_id in user_ids}
+    if not scopes:
+        return
+    ChangeCounter.objects.bulk_create([ChangeCounter(scope=scope) for scope in scopes], ignore_conflicts=True)
+    ChangeCounter.objects.filter(scope__in=scopes).update(version=F('version') + 1)
+
+
+async def abump_notification_versions(user_ids):
+    """Async twin of bump_notification_versions for async views."""
+    scopes = {scope_for(user_id) for user_id in user_ids}
+    if not scopes:
+        return
+    await ChangeCounter.objects.abulk_create(
+        [ChangeCounter(scope=scope) for scope in scopes], ignore_conflicts=True
+    )
+    await ChangeCounter.objects.filter(scope__in=scopes).aupdate(version=F('version') + 1)
+
+
+async def anotification_version(user):
+    user_id = user.id if user is not None and user.is_authenticated else None
+    return (
+        await ChangeCounter.objects.filter(scope=scope_for(user_id))
+        .values_list('version', flat=True)
+        .afirst()
+    ) or 0
+
+
+async def arecord_deletions(notifications):
+    """
+    Tombstone deleted notifications for delta sync and bump their audiences'
+    versions. Call after deleting; takes (notification_id, user_id) pairs.
+    """
+    notifications = list(notifications)
+    if not notifications:
+        return
+    now = timezone.now()
+    await NotificationTombstone.objects.abulk_create([
+        NotificationTombstone(notification_id=notification_id, user_id=user_id, deleted_at=now)
+        for notification_id, user_id in notifications
+    ])
+    await abump_notification_versions({user_id for _, user_id in notifications})
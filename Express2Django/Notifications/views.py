@@ -1,18 +1,29 @@
+import hashlib
+import hmac
+import logging
 import os
 from django.shortcuts import render
 from django.http import HttpResponse, JsonResponse
-from django.views.decorators.http import require_POST
-from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition, require_POST
+from datetime import datetime, timedelta, timezone as dt_timezone
+from urllib.parse import urlparse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from .models import Notification, PushSubscription
 from django.utils import timezone
+from django.db.models import F, Q
+from .functions import EpochMillis
+from .metrics import NOTIFICATIONS_SCHEDULED, scrape_registry
+from .models import Notification, NotificationTombstone, PushSubscription, Topic, TopicMembership
+from .remotelog import get_buffer, normalize
+from .routers import use_replica
+from .versioning import abump_notification_versions, anotification_version, arecord_deletions, scope_for
 import json
-import pywebpush
 
-
-# Import Celery task functionality
-from celery import shared_task
+logger = logging.getLogger(__name__)
 
 def index(request):
     # Add debug information to the context
@@ -24,203 +35,515 @@ def index(request):
     
     return render(request, 'index.html', {'debug_info': debug_info})
 
+# Columns clients may ask for with ?fields=, with timestamps as epoch millis
+SCHEDULED_FIELDS = {
+    'id': F('id'),
+    'title': F('title'),
+    'body': F('body'),
+    'scheduled_time': EpochMillis('scheduled_time'),
+    'repeat': F('repeat'),
+    'repeat_interval': F('repeat_interval'),
+    'created_at': EpochMillis('created_at'),
+}
+DEFAULT_SCHEDULED_FIELDS = ['id', 'title', 'body', 'scheduled_time', 'repeat', 'repeat_interval']
+SCHEDULED_PAGE_SIZE = 100
+SCHEDULED_MAX_PAGE_SIZE = 500
+
+def parse_list_params(request, default_limit):
+    """
+    The limit and fields query parameters shared by the notification list
+    views. Raises ValueError with a client-facing message.
+    """
+    limit = min(max(int(request.GET.get('limit', default_limit)), 1), SCHEDULED_MAX_PAGE_SIZE)
+    fields = request.GET.get('fields')
+    fields = fields.split(',') if fields else DEFAULT_SCHEDULED_FIELDS
+    unknown = [field for field in fields if field not in SCHEDULED_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return limit, fields
+
+def encode_cursor(scheduled_time, notification_id):
+    # Keyset position: the (scheduled_time, id) of the last row on the page
+    return f"{int(scheduled_time.timestamp() * 1_000_000)}_{notification_id}"
+
+def decode_cursor(cursor):
+    try:
+        micros, notification_id = cursor.split('_')
+        scheduled_time = datetime.fromtimestamp(int(micros) / 1_000_000, tz=dt_timezone.utc)
+        return scheduled_time, int(notification_id)
+    except (ValueError, OverflowError, OSError):
+        raise ValueError("Invalid cursor")
+
 @csrf_exempt
-def get_scheduled_notifications(request):
+@use_replica
+async def get_scheduled_notifications(request):
+    """
+    One page of the caller's unsent notifications, oldest first.
 
+    Query parameters: limit (default 100, max 500), cursor (the "next" value
+    from the previous page) and fields (comma-separated subset of
+    SCHEDULED_FIELDS). Responds 304 when If-None-Match matches.
+    """
+    user = await request.auser()
+    
+    # Any change to the audience's pending list bumps its counter, so the
+    # counter alone answers conditional requests. The scope is in the tag:
+    # versions are per audience, and two users can both be at "v1"
+    etag = quote_etag(f"{scope_for(user.id)}-v{await anotification_version(user)}")
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    
+    try:
+        limit, fields = parse_list_params(request, SCHEDULED_PAGE_SIZE)
+        cursor = request.GET.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
     
     # For anonymous users or testing, this can work without login
-    if request.user.is_authenticated:
-        notifications = list(Notification.objects.filter(
-            user=request.user,
-            sent=False
-        ).values())
+    notifications = Notification.objects.pending_for(user)
+    if after:
+        scheduled_time, notification_id = after
+        notifications = notifications.filter(
+            Q(scheduled_time__gt=scheduled_time) | Q(scheduled_time=scheduled_time, id__gt=notification_id)
+        )
+    
+    # The raw (scheduled_time, id) pair rides along for the next cursor
+    rows = [row async for row in notifications.values_list(
+        'scheduled_time', 'id', *(SCHEDULED_FIELDS[field] for field in fields)
+    )[:limit + 1]]
+    
+    next_cursor = encode_cursor(*rows[limit - 1][:2]) if len(rows) > limit else None
+    results = [dict(zip(fields, row[2:])) for row in rows[:limit]]
+    
+    response = JsonResponse({"results": results, "next": next_cursor})
+    response['ETag'] = etag
+    return response
+
+def encode_sync_cursor(version, updated_at, notification_id):
+    # Change counter at read time, then the (updated_at, id) keyset position
+    return f"{version}.{int(updated_at.timestamp() * 1_000_000)}_{notification_id}"
+
+def decode_sync_cursor(cursor):
+    try:
+        version, position = cursor.split('.')
+        version = int(version)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    updated_at, notification_id = decode_cursor(position)
+    return version, updated_at, notification_id
+
+@csrf_exempt
+async def notification_changes(request):
+    """
+    Delta sync: what changed in the caller's notifications since a cursor.
+
+    Query parameters: since (the "cursor" from the last response; omit for a
+    full snapshot), limit and fields as for get_scheduled_notifications.
+    Returns {"changes": [...pending notifications to upsert],
+    "removed": [ids deleted or no longer pending], "cursor": ..., "more": bool,
+    "reset": bool}. On reset the client replaces its copy with the changes.
+    """
+    user = await request.auser()
+    # Read before any rows, so a change racing this request bumps past it
+    version = await anotification_version(user)
+    
+    try:
+        limit, fields = parse_list_params(request, SCHEDULED_MAX_PAGE_SIZE)
+        if 'id' not in fields:
+            fields = ['id', *fields]
+        since = request.GET.get('since')
+        since = decode_sync_cursor(since) if since else None
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    
+    now = timezone.now()
+    retention = timedelta(days=settings.NOTIFICATION_TOMBSTONE_RETENTION_DAYS)
+    # Tombstones older than the retention are gone, so start over
+    reset = since is None or since[1] < now - retention
+    
+    if not reset and since[0] == version and since[2] == 0:
+        # A caught-up cursor (id 0) and nothing changed since: no row queries.
+        # Mid-page cursors carry a row id and always read on
+        return JsonResponse({"changes": [], "removed": [], "cursor": request.GET['since'], "more": False, "reset": False})
+    
+    user_filter = Q(user=user) if user.is_authenticated else Q(user__isnull=True)
+    notifications = Notification.objects.owned_by(user).order_by('updated_at', 'id')
+    removed = []
+    if reset:
+        notifications = notifications.filter(sent=False)
     else:
-        notifications = list(Notification.objects.filter(
-            user=None,
-            sent=False
-        ).values())
+        _, updated_at, notification_id = since
+        notifications = notifications.filter(
+            Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=notification_id)
+        )
+        removed = [notification_id async for notification_id in NotificationTombstone.objects.filter(
+            user_filter, deleted_at__gt=updated_at
+        ).values_list('notification_id', flat=True)]
+    
+    rows = [row async for row in notifications.values_list(
+        'updated_at', 'id', 'sent', *(SCHEDULED_FIELDS[field] for field in fields)
+    )[:limit + 1]]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    
+    changes = []
+    for updated_at, notification_id, sent, *values in rows:
+        if sent:
+            removed.append(notification_id)
+        else:
+            changes.append(dict(zip(fields, values)))
     
-    # Convert datetime objects to timestamps for JavaScript
-    for notification in notifications:
-        notification['scheduled_time'] = int(notification['scheduled_time'].timestamp() * 1000)
+    if more:
+        cursor = encode_sync_cursor(version, *rows[-1][:2])
+    else:
+        # Hold the cursor back a little so a transaction that committed late
+        # with an earlier updated_at is still picked up; repeats are upserts
+        settled = now - timedelta(seconds=settings.NOTIFICATION_SYNC_SETTLE_SECONDS)
+        cursor = encode_sync_cursor(version, max(settled, since[1]) if since else settled, 0)
     
-    return JsonResponse(notifications, safe=False)
+    return JsonResponse({"changes": changes, "removed": removed, "cursor": cursor, "more": more, "reset": reset})
+
+def owner_of(user):
+    # Anonymous callers own the anonymous (user=NULL) notifications
+    return user if user.is_authenticated else None
 
 @csrf_exempt
-def delete_notification(request, notification_id):
+async def delete_notification(request, notification_id):
     if request.method == 'DELETE':
-        try:
-            notification = Notification.objects.get(id=notification_id)
-            notification.delete()
-            return JsonResponse({"success": True})
-        except Notification.DoesNotExist:
+        owner = owner_of(await request.auser())
+        # Scoped to the caller, so someone else's id is simply not found
+        deleted, _ = await Notification.objects.owned_by(owner).filter(id=notification_id).adelete()
+        if not deleted:
             return JsonResponse({"error": "Notification not found"}, status=404)
+        await arecord_deletions([(notification_id, owner.id if owner else None)])
+        return JsonResponse({"success": True})
     return JsonResponse({"error": "Method not allowed"}, status=405)
 
+# Most ids one acknowledge request may carry
+MAX_ACK_BATCH = 1000
+
+@csrf_exempt
+@require_POST
+async def acknowledge_notifications(request):
+    """
+    Acknowledge notifications the client has shown, in one request:
+    {"ids": [...], "action": "delete" | "sent"}. "delete" (the default)
+    removes them, "sent" keeps them but marks them sent. Ids that are not
+    the caller's, or already gone, are ignored, as are recurring rules for
+    "sent" (sent=True would stop the rule for good); the response lists the
+    ids acted on.
+    """
+    try:
+        data = json.loads(request.body)
+        ids = data.get('ids') if isinstance(data, dict) else None
+        action = data.get('action', 'delete') if isinstance(data, dict) else None
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError("ids must be a list of notification ids")
+        if action not in ('delete', 'sent'):
+            raise ValueError(f"Unknown action: {action}")
+    except ValueError as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+    if len(ids) > MAX_ACK_BATCH:
+        return JsonResponse(
+            {"success": False, "error": f"At most {MAX_ACK_BATCH} ids per request"},
+            status=413,
+        )
+    
+    owner = owner_of(await request.auser())
+    owner_id = owner.id if owner else None
+    notifications = Notification.objects.owned_by(owner).filter(id__in=set(ids))
+    if action == 'delete':
+        acked = [notification_id async for notification_id in notifications.values_list('id', flat=True)]
+        if acked:
+            await Notification.objects.owned_by(owner).filter(id__in=acked).adelete()
+            await arecord_deletions([(notification_id, owner_id) for notification_id in acked])
+    else:
+        notifications = notifications.filter(sent=False, repeat='none')
+        acked = [notification_id async for notification_id in notifications.values_list('id', flat=True)]
+        if acked:
+            await Notification.objects.filter(id__in=acked, sent=False).aupdate(sent=True, updated_at=timezone.now())
+            await abump_notification_versions([owner_id])
+    
+    return JsonResponse({"success": True, "acknowledged": acked})
+
+def parse_subscription(body):
+    """
+    The PushSubscription JSON posted by the browser. Raises ValueError with a
+    client-facing message unless it is an object with an http(s) endpoint.
+    """
+    subscription_data = json.loads(body)
+    endpoint = subscription_data.get('endpoint') if isinstance(subscription_data, dict) else None
+    if not isinstance(endpoint, str) or not endpoint:
+        raise ValueError("Subscription has no endpoint")
+    url = urlparse(endpoint)
+    if url.scheme not in ('http', 'https') or not url.hostname:
+        raise ValueError("Subscription endpoint must be an http(s) URL")
+    if len(endpoint) > PushSubscription._meta.get_field('endpoint').max_length:
+        raise ValueError("Subscription endpoint is too long")
+    return subscription_data
+
 # Improved view for saving a subscription
 @csrf_exempt
 @require_POST
-def save_subscription(request):
+async def save_subscription(request):
     try:
-        subscription_data = json.loads(request.body)
+        subscription_data = parse_subscription(request.body)
+    except ValueError as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+    endpoint = subscription_data['endpoint']
+    
+    try:
+        user = await request.auser()
         
-        # Create or update subscription to avoid duplicates
-        subscription, created = PushSubscription.objects.update_or_create(
-            user=request.user if request.user.is_authenticated else None,
-            subscription_json__endpoint=subscription_data.get('endpoint'),
-            defaults={'subscription_json': subscription_data}
+        # Single INSERT ... ON CONFLICT (endpoint) DO UPDATE to avoid duplicates
+        subscription = PushSubscription(
+            user=user if user.is_authenticated else None,
+            endpoint=endpoint,
+            subscription_json=subscription_data,
+        )
+        await PushSubscription.objects.abulk_create(
+            [subscription],
+            update_conflicts=True,
+            unique_fields=['endpoint'],
+            # Re-subscribing clears any failure streak
+            update_fields=['user', 'subscription_json', 'failed_attempts'],
         )
         
         return JsonResponse({
             "success": True, 
-            "id": subscription.id,
-            "created": created
+            "id": subscription.id
         })
     except Exception as e:
         return JsonResponse({"success": False, "error": str(e)}, status=500)
     
     
-from .tasks import schedule_notification_task
+from .scheduler import schedule_notifications
+
+# Most notifications one bulk scheduling request may carry
+MAX_SCHEDULE_BATCH = 5000
+
+async def atopic_ids(items):
+    # Topic name -> id for every topic the posted notifications name, in one query
+    names = {data.get('topic') for data in items if isinstance(data, dict) and isinstance(data.get('topic'), str)}
+    if not names:
+        return {}
+    return {name: topic_id async for name, topic_id in Topic.objects.filter(name__in=names).values_list('name', 'id')}
+
+def parse_notification(data, user, topics=None):
+    """
+    Validate one notification as posted by the client and return an unsaved
+    Notification. `topics` maps topic names to ids (see atopic_ids). Raises
+    ValueError with a client-facing message.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Notification must be an object")
+    
+    title = data.get('title')
+    body = data.get('body', '')
+    if not isinstance(title, str) or not title:
+        raise ValueError("title is required")
+    if len(title) > 255:
+        raise ValueError("title is longer than 255 characters")
+    if not isinstance(body, str):
+        raise ValueError("body must be a string")
+    
+    # Parse the millisecond timestamp as UTC
+    try:
+        scheduled_time = datetime.fromtimestamp(int(data.get('scheduledTime')) / 1000, tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError("scheduledTime must be a millisecond timestamp")
+    
+    repeat = data.get('repeat', 'none')
+    if not isinstance(repeat, str) or repeat not in dict(Notification.REPEAT_CHOICES):
+        raise ValueError(f"Unknown repeat: {repeat}")
+    try:
+        repeat_interval = max(int(data.get('repeatInterval', 1)), 1)
+    except (TypeError, ValueError):
+        raise ValueError("repeatInterval must be a positive integer")
+    
+    topic = data.get('topic')
+    if topic is not None:
+        # Broadcasts reach every member, so only staff may send them
+        if not user.is_staff:
+            raise ValueError("Only staff can send to a topic")
+        if not isinstance(topic, str) or topic not in (topics or {}):
+            raise ValueError(f"Unknown topic: {topic}")
+    
+    return Notification(
+        user=user if user.is_authenticated else None,
+        topic_id=topics[topic] if topic is not None else None,
+        title=title,
+        body=body,
+        scheduled_time=scheduled_time,
+        repeat=repeat,
+        repeat_interval=repeat_interval,
+    )
+
 # Enhanced view for scheduling notifications with Celery
 @csrf_exempt
 @require_POST
-def schedule_notification(request):
+async def schedule_notification(request):
     try:
         data = json.loads(request.body)
         
-        # Parse timestamp and ensure UTC timezone
-        scheduled_time = datetime.fromtimestamp(int(data.get('scheduledTime')) / 1000)
-        scheduled_time = timezone.make_aware(scheduled_time)
-        
-        # Add debug logging
-        print(f"Scheduling notification for: {scheduled_time} UTC")
-        print(f"Current time is: {timezone.now()} UTC")
+        try:
+            notification = parse_notification(data, await request.auser(), await atopic_ids([data]))
+        except ValueError as e:
+            return JsonResponse({"success": False, "error": str(e)}, status=400)
         
-        notification = Notification.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            title=data.get('title'),
-            body=data.get('body'),
-            scheduled_time=scheduled_time,
-            repeat=data.get('repeat', 'none')
-        )
+        await notification.asave()
+        NOTIFICATIONS_SCHEDULED.labels('single').inc()
+        await abump_notification_versions([notification.user_id])
         
-        # Schedule the Celery task directly
-        result = schedule_notification_task.delay(notification.id, scheduled_time)
+        # Only dispatched now if it is due within the current bucket;
+        # otherwise the beat dispatcher picks it up when its time comes
+        dispatched = await sync_to_async(schedule_notifications)([notification])
         
-        print(f"Created notification: ID={notification.id}, Time={notification.scheduled_time}, Sent={notification.sent}")
-        print(f"Scheduled Celery task: {result.id}")
+        logger.debug("Scheduled notification", extra={
+            'notification_id': notification.id,
+            'scheduled_time': notification.scheduled_time,
+            'dispatched': bool(dispatched),
+        })
         
-        return JsonResponse({"success": True, "id": notification.id, "task_id": result.id})
+        return JsonResponse({"success": True, "id": notification.id, "dispatched": bool(dispatched)})
     except Exception as e:
-        print(f"Error scheduling notification: {str(e)}")
+        logger.exception("Error scheduling notification")
         return JsonResponse({"success": False, "error": str(e)}, status=500)
 
-# Function to schedule a push notification task
-def schedule_push_notification_task(notification_id, scheduled_time):
-    # Schedule the task to be executed at the scheduled time
-    send_push_notification.apply_async(
-        args=[notification_id],
-        eta=scheduled_time
-    )
+def read_batch(request):
+    """
+    The items of a bulk request: a JSON array, or NDJSON (one object per
+    line) when sent as application/x-ndjson, which is read line by line. A
+    malformed NDJSON line becomes a ValueError item, reported for that item
+    alone.
+    """
+    if request.content_type == 'application/x-ndjson':
+        items = []
+        for line_number, line in enumerate(request, 1):
+            line = line.strip()
+            if line:
+                try:
+                    items.append(json.loads(line))
+                except ValueError as e:
+                    items.append(ValueError(f"Line {line_number}: invalid JSON ({e})"))
+            if len(items) > MAX_SCHEDULE_BATCH:
+                break
+        return items
+    
+    items = json.loads(request.body)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array of notifications")
+    return items
 
-# Celery task to send push notification
-@shared_task
-def send_push_notification(notification_id):
+@csrf_exempt
+@require_POST
+async def schedule_notifications_batch(request):
+    """
+    Schedule many notifications in one request. Valid items are inserted with
+    one bulk_create and anything already due is enqueued in one group; each
+    item gets back either its new id or its validation error.
+    """
     try:
-        notification = Notification.objects.get(id=notification_id)
-        
-        # Mark notification as sent
-        notification.sent = True
-        notification.save()
-        
-        # If this is a recurring notification, schedule the next occurrence
-        if notification.repeat != 'none':
-            if notification.repeat == 'daily':
-                next_time = notification.scheduled_time + timedelta(days=1)
-            elif notification.repeat == 'weekly':
-                next_time = notification.scheduled_time + timedelta(weeks=1)
-                
-            # Create a new notification for the next occurrence
-            new_notification = Notification.objects.create(
-                user=notification.user,
-                title=notification.title,
-                body=notification.body,
-                scheduled_time=next_time,
-                repeat=notification.repeat
-            )
-            
-            # Schedule the next push notification
-            schedule_push_notification_task(new_notification.id, next_time)
-        
-        # Get all subscriptions for this user
-        if notification.user:
-            subscriptions = PushSubscription.objects.filter(user=notification.user)
-        else:
-            subscriptions = PushSubscription.objects.filter(user=None)
-            
-        # Send push notification to all subscriptions
-        for subscription in subscriptions:
-            try:
-                subscription_data = subscription.subscription_json
-                
-                payload = json.dumps({
-                    "title": notification.title,
-                    "body": notification.body,
-                    "data": {
-                        "notificationId": notification.id
-                    }
-                })
-                
-                # VAPID keys should be configured in your settings
-                vapid_private_key = settings.VAPID_PRIVATE_KEY
-                vapid_claims = {
-                    "sub": f"mailto:{settings.VAPID_ADMIN_EMAIL}"
-                }
-                
-                # Send the push notification
-                pywebpush.webpush(
-                    subscription_info=subscription_data,
-                    data=payload,
-                    vapid_private_key=vapid_private_key,
-                    vapid_claims=vapid_claims
-                )
-            except Exception as e:
-                print(f"Failed to send to subscription {subscription.id}: {str(e)}")
-                
-    except Notification.DoesNotExist:
-        print(f"Notification {notification_id} not found")
+        items = read_batch(request)
+    except ValueError as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+    if len(items) > MAX_SCHEDULE_BATCH:
+        return JsonResponse(
+            {"success": False, "error": f"At most {MAX_SCHEDULE_BATCH} notifications per request"},
+            status=413,
+        )
+    
+    user = await request.auser()
+    topics = await atopic_ids(items)
+    results = []
+    valid = []
+    for index, data in enumerate(items):
+        try:
+            if isinstance(data, ValueError):
+                raise data
+            valid.append((index, parse_notification(data, user, topics)))
+        except ValueError as e:
+            results.append({"index": index, "error": str(e)})
+    
+    try:
+        notifications = await Notification.objects.abulk_create([n for _, n in valid], batch_size=1000)
+        NOTIFICATIONS_SCHEDULED.labels('batch').inc(len(notifications))
+        await abump_notification_versions({n.user_id for n in notifications})
+        dispatched = await sync_to_async(schedule_notifications)(notifications)
     except Exception as e:
-        print(f"Error sending push notification: {str(e)}")
+        logger.exception("Error bulk scheduling notifications", extra={'items': len(valid)})
+        return JsonResponse({"success": False, "error": str(e)}, status=500)
+    
+    results.extend({"index": index, "id": n.id} for index, n in valid)
+    results.sort(key=lambda result: result["index"])
+    
+    return JsonResponse({
+        "success": True,
+        "created": len(valid),
+        "failed": len(items) - len(valid),
+        "dispatched": dispatched,
+        "results": results,
+    })
+
+@csrf_exempt
+async def topic_subscription(request, name):
+    """
+    POST joins the push subscription {"endpoint": ...} to the topic, DELETE
+    leaves it. Topics are only created by the set_topic_members command;
+    an unknown name is a 404.
+    """
+    if request.method not in ('POST', 'DELETE'):
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    topic_id = await Topic.objects.filter(name=name).values_list('id', flat=True).afirst()
+    if topic_id is None:
+        return JsonResponse({"success": False, "error": "Topic not found"}, status=404)
+    try:
+        endpoint = json.loads(request.body).get('endpoint')
+    except (ValueError, AttributeError):
+        endpoint = None
+    if not isinstance(endpoint, str) or not endpoint:
+        return JsonResponse({"success": False, "error": "endpoint is required"}, status=400)
+    
+    subscription_id = await PushSubscription.objects.filter(endpoint=endpoint).values_list('id', flat=True).afirst()
+    if subscription_id is None:
+        return JsonResponse({"success": False, "error": "Subscription not found"}, status=404)
+    
+    if request.method == 'POST':
+        await TopicMembership.objects.abulk_create(
+            [TopicMembership(topic_id=topic_id, subscription_id=subscription_id)], ignore_conflicts=True
+        )
+    else:
+        await TopicMembership.objects.filter(topic_id=topic_id, subscription_id=subscription_id).adelete()
+    return JsonResponse({"success": True})
 
 # Add this endpoint to your views.py
 # what the fuck
 
 @csrf_exempt
-def send_test_notification(request):
+async def send_test_notification(request):
     if request.method == 'POST':
         try:
-            print("Received test notification request")
             data = json.loads(request.body.decode('utf-8'))
             subscription = data.get('subscription')
             delay = data.get('delay', 2000)  # Default 2 seconds like Express
             
-            print(f"Subscription data: {subscription}")
-            
             # For iOS, we need to ensure the delay is not too long
             if delay > 5000:  # Cap at 5 seconds for iOS
                 delay = 5000
                 
             # Schedule the test notification with the specified delay
-            print(f"Scheduling test notification with delay: {delay}ms")
-            task = send_test_push_notification.apply_async(
+            # Publishing blocks on the broker, so keep it off the event loop
+            task = await sync_to_async(send_test_push_notification.apply_async, thread_sensitive=False)(
                 args=[subscription],
                 countdown=delay/1000  # Convert milliseconds to seconds
             )
-            print(f"Task scheduled: {task.id}")
+            logger.debug("Test notification queued", extra={'task_id': task.id, 'delay_ms': delay})
             
             return JsonResponse({'success': True, 'task_id': task.id})
         except Exception as e:
-            print(f"Error in send_test_notification: {str(e)}")
+            logger.exception("Error in send_test_notification")
             return JsonResponse({'success': False, 'error': str(e)}, status=500)
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
@@ -228,30 +551,89 @@ def send_test_notification(request):
 from .tasks import send_test_push_notification
 
 @csrf_exempt
-def remote_log(request):
-    if request.method == 'POST':
-        try:
-            log_data = json.loads(request.body)
-            
-            # Log to server console
-            print(f"REMOTE LOG [{log_data.get('timestamp')}] [{log_data.get('userAgent')}]: {log_data.get('message')}")
-            if log_data.get('data'):
-                print(f"DATA: {json.dumps(log_data.get('data'))}")
-                
-            # You could also save to a database or file
-            return JsonResponse({'success': True})
-        except Exception as e:
-            print(f"Error in remote logging: {str(e)}")
-            return JsonResponse({'success': False, 'error': str(e)})
-    return JsonResponse({'error': 'Method not allowed'}, status=405)
+async def remote_log(request):
+    """
+    Accepts a JSON array of client log records (or a single record, as older
+    clients send) and hands them to the remote-log buffer. Returns 202 once
+    buffered; when the buffer is full the overflow is dropped and the client
+    gets a 429 with Retry-After so it backs off.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        batch = json.loads(request.body)
+        if isinstance(batch, dict):
+            batch = [batch]
+        if not isinstance(batch, list):
+            raise ValueError('Expected a JSON array of log records')
+        if len(batch) > settings.REMOTE_LOG_MAX_BATCH:
+            return JsonResponse(
+                {'success': False, 'error': f"At most {settings.REMOTE_LOG_MAX_BATCH} records per request"},
+                status=413,
+            )
+        user_agent = request.META.get('HTTP_USER_AGENT')
+        records = [normalize(raw, user_agent) for raw in batch]
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    accepted, dropped = get_buffer().offer(records)
+    response = JsonResponse(
+        {'success': not dropped, 'accepted': accepted, 'dropped': dropped},
+        status=429 if dropped else 202,
+    )
+    if dropped:
+        response['Retry-After'] = str(max(1, round(settings.REMOTE_LOG_FLUSH_INTERVAL)))
+    return response
 
 # Add a custom view to serve the service worker with proper headers
-# views.py
-def service_worker(request):
+# The script is read once per process (re-checked by mtime in DEBUG) and
+# served with validators, so browser update checks usually get a 304.
+_service_worker_cache = {}
+
+def _service_worker_script():
     path = os.path.join(settings.BASE_DIR, 'Notifications/static/service-worker.js')
-    with open(path, 'r') as file:
-        content = file.read()
+    cached = _service_worker_cache.get(path)
+    if cached and not settings.DEBUG:
+        return cached
     
-    response = HttpResponse(content, content_type='application/javascript')
+    mtime = os.stat(path).st_mtime
+    if cached and cached['mtime'] == mtime:
+        return cached
+    
+    with open(path, 'rb') as file:
+        content = file.read()
+    cached = {
+        'mtime': mtime,
+        'content': content,
+        'etag': hashlib.sha256(content).hexdigest()[:32],
+        'last_modified': datetime.fromtimestamp(mtime, tz=dt_timezone.utc),
+    }
+    _service_worker_cache[path] = cached
+    return cached
+
+# views.py
+@condition(
+    etag_func=lambda request: _service_worker_script()['etag'],
+    last_modified_func=lambda request: _service_worker_script()['last_modified'],
+)
+def service_worker(request):
+    response = HttpResponse(_service_worker_script()['content'], content_type='application/javascript')
     response['Service-Worker-Allowed'] = '/'
     return response
+
+@use_replica
+def metrics(request):
+    """
+    Prometheus exposition of delivery metrics from every worker process plus
+    the current backlog. Requires "Authorization: Bearer <METRICS_TOKEN>";
+    without a METRICS_TOKEN it is only served when DEBUG is on, since every
+    scrape runs backlog queries.
+    """
+    if not settings.METRICS_TOKEN:
+        if not settings.DEBUG:
+            return HttpResponse(status=404)
+    elif not hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(), f"Bearer {settings.METRICS_TOKEN}".encode()
+    ):
+        return HttpResponse(status=401)
+    return HttpResponse(generate_latest(scrape_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,36 @@
+# Gunicorn picks this file up automatically from the working directory.
+#
+# SERVER_MODE=wsgi (default) runs sync workers. SERVER_MODE=asgi runs the
+# async views natively on uvicorn workers, so one worker can hold many slow
+# clients and DB waits at once; it is opt-in until a load test
+# (manage.py loadtest_api) shows it ahead of wsgi for this deployment.
+# Bind address and worker count still come from PORT and WEB_CONCURRENCY.
+import os
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'Express2Django.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    # Async requests run their queries on short-lived threads, so a persistent
+    # connection would never be reused; set DB_POOL_MAX_SIZE to pool instead
+    os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+else:
+    wsgi_app = 'Express2Django.wsgi:application'
+    worker_class = 'sync'
+
+
+# prometheus_client multiprocess mode: start clean, and fold the samples of
+# workers that exit into the dead-process totals
+def on_starting(server):
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)